@@ -35,6 +35,44 @@ import {
 } from "recharts";
 
 const socket = io("http://localhost:5000");
+// Width requested for result images; the server sends a resized (cached) variant
+const IMAGE_WIDTH = 1024;
+
+// Our own /images URLs get a size, so the browser never downloads full-resolution frames to show them
+function sizedImage(url, width = IMAGE_WIDTH) {
+  if (!url || !String(url).includes("/images/")) return url;
+  return `${url}${String(url).includes("?") ? "&" : "?"}w=${width}`;
+}
+
+// Run snapshots arrive as one zlib-compressed JSON message
+async function inflateJson(buffer) {
+  const stream = new Blob([buffer]).stream().pipeThrough(new DecompressionStream("deflate"));
+  return JSON.parse(await new Response(stream).text());
+}
+
+// Rebuild testResults ({ unit: { testName: … } }) from a run snapshot's tests
+function resultsFromSnapshot(tests) {
+  const results = {};
+  tests.forEach((t) => {
+    const unit = t["unit index"] || 1;
+    const updates = t.points
+      ? t.points.map((p) => ({ result: p, pass: t.pass }))
+      : t.result != null ? [{ result: t.result, pass: t.pass }] : [];
+    results[unit] = {
+      ...(results[unit] || {}),
+      [t["test name"]]: {
+        testName: t["test name"],
+        resultType: t["result type"],
+        expectedRange: t["expected range"],
+        unit: t["result unit"],
+        updates,
+        status: t.pass,
+        finalResult: t["final result"],
+      },
+    };
+  });
+  return results;
+}
 
 // Convert backend tests object into array of nodes with children
 function convertTestsToItems(testsObj, parent = "") {
@@ -246,6 +284,11 @@ export default function App() {
   const [testRunning, setTestRunning] = useState(false);
   const [allComplete, setAllComplete] = useState(false);
   const [activeUnit, setActiveUnit] = useState(null);
+  // id of the run this client started (or follows); its events arrive in that run's Socket.IO room
+  const runIdRef = useRef(null);
+  // test_update events received while a /start is in flight, when the new run's id isn't known yet
+  const startingRef = useRef(null);
+  const handleUpdateRef = useRef(null);
 
   // testResults will be an object keyed by unitIndex: { 1: { testName: … }, 2: { … } }
   const [testResults, setTestResults] = useState({});
@@ -269,7 +312,19 @@ export default function App() {
   }, []);
 
   useEffect(() => {
+    // updates that arrive while a snapshot is being decompressed are applied after it
+    let pendingUpdates = null;
     const handleUpdate = (data) => {
+      if (pendingUpdates) {
+        pendingUpdates.push(data);
+        return;
+      }
+      if (startingRef.current) {
+        startingRef.current.push(data);
+        return;
+      }
+      // this socket may also be in another run's room (e.g. joined on connect): skip its events
+      if (runIdRef.current && data.runId !== runIdRef.current) return;
       const unit = data["unit index"] || 1;
       setActiveUnit(unit);
       setTestResults((prev) => {
@@ -289,8 +344,11 @@ export default function App() {
           updates = [];
           status = "in progress";
         } else if (data["message type"] === "update") {
-          // dedupe updates if needed…
-          updates = [...updates, { result: data.result, pass: data.pass }];
+          // vector points may arrive batched: 'results' holds every point of the batch
+          const points = Array.isArray(data.results)
+            ? data.results.map((r) => ({ result: r, pass: data.pass }))
+            : [{ result: data.result, pass: data.pass }];
+          updates = [...updates, ...points];
           status = data.pass;
         } else if (data["message type"] === "test end") {
           status = data.pass;
@@ -306,12 +364,41 @@ export default function App() {
         };
       });
     };
+    handleUpdateRef.current = handleUpdate;
+    // a reconnect gets a new sid, so rejoin the run's room
+    const handleConnect = () => {
+      if (runIdRef.current) socket.emit("join_run", { runId: runIdRef.current });
+    };
+    // joining a run (on connect, reload or join_run) starts from its snapshot; live updates follow
+    const handleSnapshot = async (buffer) => {
+      pendingUpdates = pendingUpdates || [];
+      const snap = await inflateJson(buffer);
+      if (runIdRef.current && snap.runId !== runIdRef.current) {
+        // another run's snapshot (sent on connect): keep showing ours
+        const queued = pendingUpdates;
+        pendingUpdates = null;
+        queued.forEach(handleUpdate);
+        return;
+      }
+      runIdRef.current = snap.runId;
+      setTestResults(resultsFromSnapshot(snap.tests));
+      setTestRunning(snap.state === "queued" || snap.state === "running");
+      setAllComplete(snap.state === "complete");
+      const queued = pendingUpdates;
+      pendingUpdates = null;
+      queued.forEach(handleUpdate);
+    };
+    socket.on("connect", handleConnect);
+    socket.on("run_snapshot", handleSnapshot);
     socket.on("test_update", handleUpdate);
-    socket.on("test_complete", () => {
+    socket.on("test_complete", (data) => {
+      if (runIdRef.current && data && data.runId !== runIdRef.current) return;
       setTestRunning(false);
       setAllComplete(true);
     });
     return () => {
+      socket.off("connect", handleConnect);
+      socket.off("run_snapshot", handleSnapshot);
       socket.off("test_update", handleUpdate);
       socket.off("test_complete");
     };
@@ -389,24 +476,42 @@ export default function App() {
 
   const startOrResume = async () => {
     const tests = Object.keys(selectedTests).filter((k) => selectedTests[k]);
-    await fetch("http://localhost:5000/start", {
+    // the new run's first events can arrive before its id does: hold them until then
+    startingRef.current = [];
+    try {
+      const res = await fetch("http://localhost:5000/start", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          script: selectedScript,
+          tests,
+          details: {
+            serials,
+            comments,
+            operatorName,
+          },
+          selectedUnitNumbers: selectedUnits,
+          sid: socket.id,
+        }),
+      });
+      const { runId } = await res.json();
+      runIdRef.current = runId;
+    } finally {
+      const held = startingRef.current;
+      startingRef.current = null;
+      held.forEach((data) => handleUpdateRef.current(data));
+    }
+    setTestRunning(true);
+    setAllComplete(false);
+  };
+  const stopTest = async () => {
+    await fetch("http://localhost:5000/stop", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({
-        script: selectedScript,
-        tests,
-        details: {
-          serials,
-          comments,
-          operatorName,
-        },
-        selectedUnitNumbers: selectedUnits,
-      }),
+      body: JSON.stringify({ runId: runIdRef.current }),
     });
-    setTestRunning(true);
-    setAllComplete(false);
+    setTestRunning(false);
   };
-  const stopTest = async () => { await fetch("http://localhost:5000/stop", { method: 'POST' }); setTestRunning(false); };
 
   // Open OS file dialog
   const handleViewResults = () => {
@@ -600,19 +705,10 @@ export default function App() {
                     const [xLabel = "", yLabel = ""] = r["result unit"] || [];
                     const [min = 0, max = 0] = r["expected range"] || [];
 
-                    // gather just the update points
-                    const chartData = pastResults
-                      .filter(
-                        (ev) =>
-                          ev["result type"] === "vector" &&
-                          ev["test name"] === r["test name"] &&
-                          ev["message type"] === "update" &&
-                          Array.isArray(ev.result)
-                      )
-                      .map((ev) => ({
-                        x: ev.result[0],
-                        y: ev.result[1],
-                      }));
+                    // the points come as x/y columns on the 'test end' event
+                    const xs = r.x || [];
+                    const ys = r.y || [];
+                    const chartData = xs.map((x, k) => ({ x, y: ys[k] }));
 
                     return (
                       <>
@@ -666,7 +762,7 @@ export default function App() {
                 {r["result type"] === "image" && (
                   <>
                     <img
-                      src={r.result}
+                      src={sizedImage(r.result)}
                       alt={r["test name"]}
                       style={{ maxWidth: "100%" }}
                     />
@@ -898,7 +994,7 @@ export default function App() {
 
                           {res.resultType === 'image' && res.finalResult && (
                             <Box>
-                              <img src={res.finalResult} alt={res.testName} style={{ maxWidth: '100%' }} />
+                              <img src={sizedImage(res.finalResult)} alt={res.testName} style={{ maxWidth: '100%' }} />
                               <Typography>pass = {res.status}</Typography>
                             </Box>
                           )}
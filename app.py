@@ -1,14 +1,19 @@
 import eventlet
 eventlet.monkey_patch()
 from flask import Flask, request, jsonify
-from flask import send_from_directory
-from flask_socketio import SocketIO
+from flask import send_file, Response, stream_with_context
+from flask_socketio import SocketIO, join_room, leave_room, rooms, emit
 from flask_cors import CORS
-import pandas as pd
 import os
-from test_manager import TestManager
 from io import BytesIO
-from openpyxl import load_workbook
+from werkzeug.security import safe_join
+from test_manager import TestManager
+from script_catalog import ScriptCatalog
+from image_store import get_originals, get_store
+from image_variants import get_variants
+from bulk_reader import parse_many
+from metrics import REGISTRY
+from stations import StationServer
 
 app = Flask(__name__)
 app.json.sort_keys = False
@@ -16,18 +21,76 @@ CORS(app)
 socketio = SocketIO(app, cors_allowed_origins="*")  # Enable WebSockets
 
 test_manager = TestManager(socketio)
+# Index any result files written before the results index existed
+socketio.start_background_task(test_manager.index.backfill, "results", sleep=socketio.sleep)
 SCRIPTS_DIR = "test_scripts"
 
+# Static (no-import) index of the scripts directory, kept current by a background watcher
+catalog = ScriptCatalog(SCRIPTS_DIR)
+catalog.refresh()
+socketio.start_background_task(catalog.watch, sleep=socketio.sleep)
+
+# Runs executed by station workers (station_worker.py) are streamed in here
+stations = StationServer(test_manager)
+
+# Browsers keep content-addressed images this long without asking again (seconds)
+IMMUTABLE_IMAGE_MAX_AGE = 365 * 24 * 3600
+
+def send_image(path, digest=None):
+    """
+    Send an image file, or the variant asked for with ?w=&h=&format= (resized to fit,
+    never enlarged). Responses carry a content-based ETag, so repeated views are
+    answered with 304 Not Modified. Images named by their hash (digest) never change
+    and may be cached for good; any other file is revalidated on each use.
+    """
+    try:
+        variant = get_variants().get(path, request.args.get("w"), request.args.get("h"),
+                                     request.args.get("format"), digest=digest)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if variant.path:
+        response = send_file(os.path.abspath(variant.path), etag=variant.etag, conditional=True)
+    else:
+        response = send_file(BytesIO(variant.data), mimetype=variant.mimetype, etag=variant.etag,
+                             conditional=True)
+    response.cache_control.public = True
+    if digest:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = IMMUTABLE_IMAGE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = None
+        response.cache_control.no_cache = True
+    return response
+
 # Serve images out of a local "images/" directory at /images/<filename>
 @app.route("/images/<path:filename>")
 def serve_image(filename):
     # the "images" folder is assumed to be sibling to this file (app.py)
-    return send_from_directory("images", filename)
+    path = safe_join("images", filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"error": "Image not found"}), 404
+    return send_image(path)
+
+# Content-addressed images extracted from uploaded result files
+@app.route("/images/cas/<name>")
+def serve_stored_image(name):
+    path = get_store().path(name)
+    if path is None:
+        return jsonify({"error": "Image not found"}), 404
+    return send_image(path, digest=os.path.splitext(os.path.basename(path))[0])
+
+# Full-resolution originals of the images embedded in result workbooks
+@app.route("/images/originals/<name>")
+def serve_original_image(name):
+    path = get_originals().path(name)
+    if path is None:
+        return jsonify({"error": "Image not found"}), 404
+    return send_image(path, digest=os.path.splitext(os.path.basename(path))[0])
 
 @app.route("/scripts", methods=["GET"])
 def list_scripts():
-    scripts = [f.replace(".py", "") for f in os.listdir(SCRIPTS_DIR) if f.endswith(".py")]
-    return jsonify({"scripts": scripts})
+    return jsonify({"scripts": catalog.names()})
 
 @app.route("/script_tests", methods=["POST"])
 def get_tests_for_script():
@@ -35,13 +98,51 @@ def get_tests_for_script():
     script_name = data.get("script")
     if not script_name:
         return jsonify({"error": "Script name is required", "tests": {}}), 400
-    available_tests = test_manager.get_tests(script_name)
-    max_units = test_manager.get_max_unit_support(script_name)
+    entry = catalog.get(script_name)
+    if entry is not None and entry["static"]:
+        available_tests = entry["tests"]
+        max_units = entry["multiUnitSupportedNumber"]
+    else:
+        # tree isn't a plain literal (or the file is gone): fall back to importing the script
+        available_tests = test_manager.get_tests(script_name)
+        max_units = test_manager.get_max_unit_support(script_name)
     return jsonify({
         "tests": available_tests,
         "multiUnitSupportedNumber": max_units
     })
 
+@app.route("/plan", methods=["POST"])
+def preview_plan():
+    # Same body as /start; returns the ordered steps the run would execute
+    data = request.json
+    script_name = data.get("script")
+    if not script_name:
+        return jsonify({"error": "Script name is required"}), 400
+    plan = test_manager.preview_plan(
+        script_name,
+        data.get("tests", []),
+        data.get("selectedUnitNumbers", []),
+    )
+    if plan is None:
+        return jsonify({"error": f"Unknown script '{script_name}'"}), 404
+    return jsonify(plan.to_dict())
+
+@app.route("/progress", methods=["GET"])
+def run_progress():
+    # ?run=<run id>; defaults to the most recent run
+    return jsonify(test_manager.progress(request.args.get("run")))
+
+@app.route("/runs", methods=["GET"])
+def list_runs():
+    return jsonify({"runs": test_manager.list_runs()})
+
+def join_only(run_id, sid):
+    # A browser shows one run at a time: following a run leaves any other run's room
+    for room in rooms(sid=sid, namespace="/"):
+        if room not in (sid, run_id):
+            leave_room(room, sid=sid, namespace="/")
+    join_room(run_id, sid=sid, namespace="/")
+
 @app.route("/start", methods=["POST"])
 def start_test():
     data = request.json
@@ -49,21 +150,50 @@ def start_test():
     selected_tests = data.get("tests", [])
     details = data.get("details", {})
     selected_units = data.get("selectedUnitNumbers", [])
-    if test_manager.is_running():
-        return jsonify({"status": "error", "message": "A test is already running."}), 400
-    socketio.start_background_task(
-        test_manager.run_tests,
+    run = test_manager.create_run(
         script_name,
         selected_tests,
         details,
         selected_units,
     )
-    return jsonify({"status": "success", "message": "Test started."})
+    # The starting client (its Socket.IO sid) follows the run's room from the first event
+    sid = data.get("sid")
+    if sid:
+        join_only(run.run_id, sid)
+    test_manager.start(run)
+    return jsonify({"status": "success", "message": "Test started.", "runId": run.run_id})
+
+@app.route("/resume", methods=["GET"])
+def list_resumable_runs():
+    return jsonify({"runs": test_manager.resumable_runs()})
+
+@app.route("/resume", methods=["POST"])
+def resume_test():
+    # {"runId": ...}: continue a stopped, failed or interrupted run from its last checkpoint
+    data = request.get_json(silent=True) or {}
+    run_id = data.get("runId")
+    try:
+        run = test_manager.resume(run_id)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    if run is None:
+        return jsonify({"status": "error", "message": f"No checkpoint for run '{run_id}'"}), 404
+    sid = data.get("sid")
+    if sid:
+        join_only(run.run_id, sid)
+    test_manager.start(run)
+    return jsonify({"status": "success", "message": "Test resumed.", "runId": run.run_id,
+                    "skippedSteps": len(run.completed)})
 
 @app.route("/stop", methods=["POST"])
 def stop_test():
-    test_manager.stop_test()
-    return jsonify({"status": "success", "message": "Test stopped."})
+    # {"runId": ...} stops that run; without it every unfinished run is stopped
+    data = request.get_json(silent=True) or {}
+    run_id = data.get("runId")
+    stopped = test_manager.stop_test(run_id)
+    if run_id and not stopped:
+        return jsonify({"status": "error", "message": f"Unknown run '{run_id}'"}), 404
+    return jsonify({"status": "success", "message": "Test stopped.", "runIds": stopped})
 
 
 @app.route("/results/upload", methods=["POST"])
@@ -73,20 +203,108 @@ def upload_results_file():
         return jsonify({'error': 'No file provided'}), 400
     raw = request.files["file"].read()
     try:
-        # Load every sheet into a dict of DataFrames
-        df_map = pd.read_excel(BytesIO(raw), sheet_name=None)
-        wb = load_workbook(filename=BytesIO(raw), data_only=True)
-        # Delegate parsing to TestManager
-        metadata, results = test_manager.parse_results(df_map, wb)
+        # Delegate parsing to TestManager (single read-only pass over the workbook)
+        metadata, results = test_manager.parse_results(raw)
         return jsonify({'metadata': metadata, 'results': results}), 200
     except Exception as e:
         print(e)
         return jsonify({'error': str(e)}), 500
 
+@app.route("/results/upload/bulk", methods=["POST"])
+def upload_results_files():
+    # multipart/form-data with any number of 'files' fields: result workbooks and/or zips of them.
+    # Responds with one JSON line per workbook as soon as it is parsed (NDJSON), then a summary line.
+    uploads = [(f.filename, f.read()) for f in request.files.getlist("files")]
+    if not uploads:
+        return jsonify({'error': 'No files provided'}), 400
+
+    def generate():
+        parsed = failed = 0
+        for item in parse_many(uploads):
+            if "error" in item:
+                failed += 1
+            else:
+                parsed += 1
+            yield app.json.dumps(item) + "\n"
+        yield app.json.dumps({"done": True, "parsed": parsed, "failed": failed}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/results/export", methods=["GET"])
+def export_results():
+    # e.g. /results/export?unit=1[&run=<run id>] -> that unit's workbook for that (or the latest) run
+    unit_idx = request.args.get("unit", type=int)
+    path = test_manager.export_results(unit_idx, request.args.get("run"))
+    if path is None:
+        return jsonify({"error": "No results for that unit"}), 404
+    return send_file(os.path.abspath(path), as_attachment=True)
+
+@app.route("/results/query", methods=["GET"])
+def query_results():
+    # e.g. /results/query?serial=123&test=Input_Voltage&since=2025-01-01&pass=false
+    args = request.args
+    rows = test_manager.index.query(
+        serial=args.get("serial"),
+        script=args.get("script"),
+        operator=args.get("operator"),
+        test=args.get("test"),
+        since=args.get("since"),
+        until=args.get("until"),
+        passed=args.get("pass"),
+        limit=args.get("limit", 500, type=int),
+    )
+    return jsonify({"results": rows})
+
+@app.route("/results/index/backfill", methods=["POST"])
+def backfill_results_index():
+    socketio.start_background_task(test_manager.index.backfill, "results", sleep=socketio.sleep)
+    return jsonify({"status": "success", "message": "Backfill started."})
+
+
+@app.route("/logs/export", methods=["GET"])
+def export_event_log():
+    # On-demand xlsx export of a run's event log (?run=<run id>, default the latest run)
+    path = test_manager.export_event_log(run_id=request.args.get("run"))
+    if not path:
+        return jsonify({'error': 'No run log available'}), 404
+    return send_file(os.path.abspath(path), as_attachment=True)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Prometheus text format: test function, phase, save, writer and emit timings
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+def follow_run(run):
+    # Join the run's room and get its state as one compressed "run_snapshot"; nothing is
+    # sent to the room meanwhile, so the live events that follow continue from the snapshot
+    with run.emitter.hold():
+        join_only(run.run_id, request.sid)
+        emit("run_snapshot", run.snapshot_payload())
 
 @socketio.on("connect")
 def handle_connect():
     print("A client connected:", request.sid)
+    # A browser that connects (or reloads) mid-run picks up the unfinished run, if there is
+    # only one; with several it can't tell whose run it was, so it has to join_run explicitly
+    active = test_manager.active_runs()
+    if len(active) == 1:
+        follow_run(active[0])
+
+@socketio.on("join_run")
+def handle_join_run(data):
+    # Follow a run's events (e.g. another screen, or after reconnecting)
+    run_id = (data or {}).get("runId")
+    run = test_manager.get_run(run_id)
+    if run is None:
+        return {"error": f"Unknown run '{run_id}'"}
+    follow_run(run)
+    return test_manager.progress(run_id)
 
 if __name__ == "__main__":
-    socketio.run(app, host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    debug = True
+    # Under the debug reloader only the child process serves, so only it listens for stations
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        socketio.start_background_task(stations.serve)
+    socketio.run(app, host="0.0.0.0", port=5000, debug=debug)
\ No newline at end of file
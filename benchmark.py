@@ -0,0 +1,359 @@
+"""
+Synthetic benchmark for the run -> emit -> save -> parse pipeline.
+
+    python benchmark.py --depth 2 --fanout 5 --units 4 --vector-length 2000 --out new.json
+    python benchmark.py --out new.json --compare old.json
+
+Generates a test script in the AVAILABLE_TESTS format, starts it with
+TestManager.create_run/start like the /start route does (stub socketio, no
+sleeps anywhere), parses the result files back, and prints/writes the
+measurements as JSON so runs from different commits can be compared.
+
+Everything is read from what a run produces anyway: save times from the
+Timing sheet of each result file, sheet write times from the metrics
+registry (what /metrics serves) and the result file paths from the
+results_saved events.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from openpyxl import load_workbook
+
+from metrics import REGISTRY, TIMING_SHEET
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_TYPES = ("boolean", "number", "vector", "image")
+SCRIPT_NAME = "bench_script"
+# MULTI_UNIT_SUPPORTED_NUMBER of the generated script: --units can't go beyond it
+SCRIPT_UNITS = 8
+# 1x1 PNG used by synthetic image tests
+PIXEL_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c63f8cfc0f01f0005000201a5f3b1b40000000049454e44ae426082"
+)
+# metric -> True when a bigger value is better
+METRICS = {
+    "wall_s": False,
+    "events_per_s": True,
+    "save_call_ms_p50": False,
+    "save_call_ms_p95": False,
+    "sheet_write_ms_mean": False,
+    "parse_s_per_file": False,
+    "peak_mem_mb": False,
+}
+
+_SCRIPT_TEMPLATE = '''\
+VECTOR_LENGTH = {vector_length}
+MULTI_UNIT_SUPPORTED_NUMBER = {units}
+PARALLEL_UNITS = {parallel}
+MAX_PARALLEL_UNITS = {units}
+
+
+def _report(callback, name, unit, rtype, results, passed, expected, result_unit):
+    callback({{'test name': name, 'message type': 'new test', 'unit index': unit, 'result type': rtype,
+              'expected range': expected, 'result unit': result_unit, 'result': None, 'pass': 'in progress'}})
+    for r in results:
+        callback({{'test name': name, 'message type': 'update', 'unit index': unit, 'result type': rtype,
+                  'expected range': expected, 'result': r, 'pass': 'in progress'}})
+    callback({{'test name': name, 'message type': 'test end', 'unit index': unit, 'result type': rtype,
+              'expected range': expected, 'result': results[-1] if rtype != 'vector' else None, 'pass': passed}})
+
+
+def setup(callback, full_test_name, selected_units, unit_index):
+    pass
+
+
+def boolean_test(callback, full_test_name, selected_units, unit_index):
+    _report(callback, full_test_name, unit_index, 'boolean', [True], 'true', (True,), '')
+
+
+def number_test(callback, full_test_name, selected_units, unit_index):
+    _report(callback, full_test_name, unit_index, 'number', [5.1], 'true', (4.8, 5.2), 'Volt')
+
+
+def vector_test(callback, full_test_name, selected_units, unit_index):
+    points = [[i, (i * 7919) % 100 / 10] for i in range(VECTOR_LENGTH)]
+    _report(callback, full_test_name, unit_index, 'vector', points, 'true', (0, 10), ('Time', 'Volt'))
+
+
+def image_test(callback, full_test_name, selected_units, unit_index):
+    _report(callback, full_test_name, unit_index, 'image', ['http://localhost:5000/images/bench.png'],
+            'true', None, None)
+
+
+AVAILABLE_TESTS = {tree}
+'''
+
+
+def build_tree(depth, fanout, mix):
+    """
+    Source of an AVAILABLE_TESTS literal: `fanout` once-only groups at the top, each
+    nesting `depth` - 1 levels of `fanout` subgroups, with `fanout` leaf tests per
+    innermost group, so fanout ** (depth + 1) leaf tests in all. Leaves cycle through
+    the result-type mix; group k's tests run at exec_order k + 1.
+    """
+    kinds = [t for t, weight in mix.items() for _ in range(weight)]
+    counter = [0]
+
+    def leaves(order):
+        out = []
+        for i in range(fanout):
+            kind = kinds[counter[0] % len(kinds)]
+            counter[0] += 1
+            out.append(f"'T{i}_{kind}': {{'funcs': [{kind}_test], 'exec_order': {order}}}")
+        return out
+
+    def group(level, order):
+        if level >= depth:
+            return leaves(order)
+        return [f"'G{i}': {{'funcs': [setup], 'exec_order': {order}, {', '.join(group(level + 1, order))}}}"
+                for i in range(fanout)]
+
+    top = [f"'Top{k}': {{'funcs': [setup], 'exec_order': -1, {', '.join(group(1, k + 1))}}}"
+           for k in range(fanout)]
+    return "{" + ", ".join(top) + "}"
+
+
+def all_tests(tree, parent=""):
+    names = []
+    for key, sub in tree.items():
+        full = f"{parent}/{key}" if parent else key
+        names.append(full)
+        names += all_tests(sub, full)
+    return names
+
+
+class StubSocketIO:
+    """Stands in for flask_socketio.SocketIO: counts what would be sent and keeps the saved result files."""
+
+    def __init__(self):
+        self.messages = 0
+        self.events = 0
+        self.saved = {}  # unit index -> result file path (from results_saved)
+
+    def emit(self, event, data=None, **kwargs):
+        self.messages += 1
+        if event == "test_update":
+            self.events += len(data.get("results") or [None])
+        elif event == "results_saved":
+            self.saved[data["unit index"]] = data["path"]
+
+    def start_background_task(self, target, *args, **kwargs):
+        t = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+        t.start()
+        return t
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _writer_seconds(job="write"):
+    """(sum, count) of the result writer's `job` timings so far, from the /metrics exposition."""
+    total, count = 0.0, 0
+    for line in REGISTRY.render().splitlines():
+        name, _, value = line.rpartition(" ")
+        if name == f'result_writer_seconds_sum{{job="{job}"}}':
+            total = float(value)
+        elif name == f'result_writer_seconds_count{{job="{job}"}}':
+            count = int(value)
+    return total, count
+
+
+def _save_seconds(path, unit):
+    """Durations of the unit's save_results calls, from the Timing sheet of its result file."""
+    wb = load_workbook(path, read_only=True)
+    try:
+        rows = wb[TIMING_SHEET].iter_rows(min_row=2, values_only=True)
+        return [row[5] for row in rows if row[0] == "save" and row[2] == unit]
+    finally:
+        wb.close()
+
+
+def run_once(tm, units, memory=False):
+    """One full run, started the way the /start route starts one; returns its raw measurements."""
+    sio = tm.socketio
+    sio.events = sio.messages = 0
+    sio.saved = {}
+    writes_before = _writer_seconds()
+    try:
+        if memory:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        run = tm.create_run(SCRIPT_NAME, all_tests(tm.get_tests(SCRIPT_NAME)),
+                            {"serials": [f"SN{u}" for u in units], "operatorName": "bench"}, units)
+        tm.start(run)
+        while tm.is_running(run.run_id):
+            time.sleep(0.001)
+        wall = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+    if run.state != "complete":
+        raise RuntimeError(f"benchmark run ended {run.state}")
+    writes_after = _writer_seconds()
+
+    paths = [sio.saved[u] for u in units]
+    save_calls = [s for u, path in zip(units, paths) for s in _save_seconds(path, u)]
+    t0 = time.perf_counter()
+    for path in paths:
+        with open(path, "rb") as f:
+            tm.parse_results(f.read())
+    parse = (time.perf_counter() - t0) / len(paths)
+    # runs within the same second would otherwise reopen (and pay for loading) these files
+    for path in paths:
+        os.remove(path)
+        shutil.rmtree(os.path.splitext(path)[0], ignore_errors=True)
+
+    return {"wall": wall, "events": sio.events, "save_calls": save_calls,
+            "write_s": writes_after[0] - writes_before[0], "writes": writes_after[1] - writes_before[1],
+            "parse": parse, "peak": peak}
+
+
+def run_benchmark(args):
+    mix = {t: w for t, w in args.mix.items() if w > 0}
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    cwd = os.getcwd()
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(work_dir)
+    try:
+        os.makedirs("test_scripts")
+        os.makedirs("images")
+        with open(os.path.join("images", "bench.png"), "wb") as f:
+            f.write(PIXEL_PNG)
+        with open(os.path.join("test_scripts", f"{SCRIPT_NAME}.py"), "w") as f:
+            f.write(_SCRIPT_TEMPLATE.format(
+                vector_length=args.vector_length, units=SCRIPT_UNITS, parallel=args.parallel,
+                tree=build_tree(args.depth, args.fanout, mix)))
+
+        import result_writer
+        from test_manager import TestManager
+        if args.backend:
+            result_writer.RESULTS_BACKEND = args.backend
+
+        tm = TestManager(StubSocketIO())
+        max_units = tm.get_max_unit_support(SCRIPT_NAME)
+        if args.units > max_units:
+            raise ValueError(f"{SCRIPT_NAME} supports at most {max_units} units, not {args.units}")
+        units = list(range(1, args.units + 1))
+        runs = [run_once(tm, units) for _ in range(args.repeat)]
+        peak = run_once(tm, units, memory=True)["peak"] if args.memory else None
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    def median(key):
+        return statistics.median(r[key] for r in runs)
+
+    save_calls = [s for r in runs for s in r["save_calls"]]
+    writes = sum(r["writes"] for r in runs)
+    metrics = {
+        "wall_s": round(median("wall"), 4),
+        "events": runs[0]["events"],
+        "events_per_s": round(runs[0]["events"] / median("wall"), 1),
+        "tests_saved": len(runs[0]["save_calls"]),
+        "save_call_ms_p50": round(_percentile(save_calls, 0.5) * 1000, 3),
+        "save_call_ms_p95": round(_percentile(save_calls, 0.95) * 1000, 3),
+        "sheet_write_ms_mean": round(sum(r["write_s"] for r in runs) / writes * 1000, 3) if writes else None,
+        "parse_s_per_file": round(median("parse"), 4),
+        "peak_mem_mb": round(peak / 2 ** 20, 2) if peak is not None else None,
+    }
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "threshold")},
+        "env": {"python": platform.python_version(), "platform": platform.platform(), "commit": _git_commit()},
+        "metrics": metrics,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold):
+    """Per-metric change between two reports; returns (rows, regressed)."""
+    rows = []
+    regressed = False
+    for name, higher_is_better in METRICS.items():
+        a, b = old["metrics"].get(name), new["metrics"].get(name)
+        if not a or b is None:
+            continue
+        change = (b - a) / a
+        worse = change < -threshold if higher_is_better else change > threshold
+        regressed = regressed or worse
+        rows.append((name, a, b, change, worse))
+    return rows, regressed
+
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in RESULT_TYPES:
+            raise argparse.ArgumentTypeError(f"unknown result type: {name}")
+        mix[name] = int(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("mix needs at least one result type")
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark TestManager's run/save/emit/parse pipeline.")
+    parser.add_argument("--depth", type=int, default=2, help="levels of groups below each top-level group")
+    parser.add_argument("--fanout", type=int, default=4,
+                        help="top-level groups, subgroups per group and leaf tests per innermost group "
+                             "(fanout ** (depth + 1) leaf tests in all)")
+    parser.add_argument("--units", type=int, default=4, help=f"units to run (1-{SCRIPT_UNITS})")
+    parser.add_argument("--mix", type=_parse_mix, default="boolean=1,number=1,vector=1,image=1",
+                        help="result-type weights, e.g. number=3,vector=1")
+    parser.add_argument("--vector-length", type=int, default=1000)
+    parser.add_argument("--parallel", action="store_true", help="run units in parallel (PARALLEL_UNITS)")
+    parser.add_argument("--backend", choices=("xlsx", "parquet"), default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="skip the extra tracemalloc run for peak memory")
+    parser.add_argument("--out", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="report JSON from another commit to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    args = parser.parse_args(argv)
+    if not 1 <= args.units <= SCRIPT_UNITS:
+        parser.error(f"--units must be between 1 and {SCRIPT_UNITS}")
+
+    report = run_benchmark(args)
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        rows, regressed = compare(old, report, args.threshold)
+        for name, a, b, change, worse in rows:
+            print(f"{name:20} {a:>12} -> {b:<12} {change:+.1%}{'  REGRESSION' if worse else ''}", file=sys.stderr)
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
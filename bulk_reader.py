@@ -0,0 +1,68 @@
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+from results_reader import read_results
+
+# Worker processes used to parse uploaded result files
+BULK_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+
+def upload_items(files):
+    """
+    (name, bytes) of every results workbook in an upload: the .xlsx files themselves,
+    plus the .xlsx members of any .zip among them.
+    """
+    for name, raw in files:
+        if _is_archive(raw):
+            with zipfile.ZipFile(BytesIO(raw)) as zf:
+                for info in zf.infolist():
+                    member = info.filename
+                    if info.is_dir() or not member.lower().endswith(".xlsx") \
+                            or member.startswith("__MACOSX/") or os.path.basename(member).startswith("~$"):
+                        continue
+                    yield f"{name}/{member}", zf.read(info)
+        else:
+            yield name, raw
+
+
+def _is_archive(raw):
+    # an .xlsx is itself a zip, so only a zip without the OOXML manifest counts as an archive
+    if not zipfile.is_zipfile(BytesIO(raw)):
+        return False
+    with zipfile.ZipFile(BytesIO(raw)) as zf:
+        return "[Content_Types].xml" not in zf.namelist()
+
+
+def parse_file(name, raw):
+    """Parse one workbook in a worker; errors are returned instead of raised so one bad file can't stop a batch."""
+    try:
+        metadata, results = read_results(raw)
+        return {"file": name, "metadata": metadata, "results": results}
+    except Exception as e:
+        return {"file": name, "error": f"{type(e).__name__}: {e}"}
+
+
+def parse_many(files, workers=BULK_WORKERS):
+    """
+    Parse many uploaded workbooks (or zips of them) in a process pool and yield
+    each file's parse_file() result as soon as it finishes, in completion order.
+    Under eventlet, waiting here only blocks the calling green thread.
+    """
+    items = list(upload_items(files))
+    if not items:
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(items))) as pool:
+        futures = {pool.submit(parse_file, name, raw): name for name, raw in items}
+        try:
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    # the worker process itself died (e.g. out of memory)
+                    yield {"file": futures[future], "error": f"{type(e).__name__}: {e}"}
+        except GeneratorExit:
+            # the client went away: drop the files that haven't started yet
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
@@ -0,0 +1,98 @@
+import heapq
+import inspect
+import itertools
+import time
+
+
+class Wait:
+    """A pause requested by a cooperative test function: `yield wait(s)` or `await wait(s)`."""
+
+    __slots__ = ("seconds",)
+
+    def __init__(self, seconds):
+        self.seconds = max(0.0, float(seconds))
+
+    def __await__(self):
+        yield self
+
+
+def wait(seconds):
+    """
+    Let other units' tests run for `seconds`. In a generator test function
+    `yield wait(0.2)`; in an `async def` one `await wait(0.2)`. Generators may also
+    yield a plain number of seconds, or a result dict to report it.
+    """
+    return Wait(seconds)
+
+
+def is_cooperative(fn):
+    return inspect.isgeneratorfunction(fn) or inspect.iscoroutinefunction(fn)
+
+
+def _as_wait(item):
+    if isinstance(item, Wait):
+        return item
+    if item is None:
+        return Wait(0)
+    if isinstance(item, (int, float)) and not isinstance(item, bool):
+        return Wait(item)
+    raise TypeError(f"cooperative test functions can only wait (got {item!r})")
+
+
+def drive(call, report):
+    """
+    Step through what a test function call returned: a generator or coroutine
+    yields one Wait per pause (result dicts it yields go to `report`); anything
+    else was a plain function's return value and yields nothing.
+    """
+    if inspect.iscoroutine(call):
+        while True:
+            try:
+                item = call.send(None)
+            except StopIteration:
+                return
+            yield _as_wait(item)
+    elif inspect.isgenerator(call):
+        for item in call:
+            if isinstance(item, dict):
+                report(item)
+            else:
+                yield _as_wait(item)
+
+
+def run_blocking(task, sleep=None):
+    """Run one task to the end, really sleeping through its waits."""
+    sleep = sleep or time.sleep
+    for w in task:
+        if w.seconds:
+            sleep(w.seconds)
+
+
+def run_interleaved(tasks, should_run=None, sleep=None):
+    """
+    Run tasks (generators of Wait) together on this thread: whenever one waits,
+    the others that are due run meanwhile, so waits overlap instead of adding up.
+    Tasks that are due at the same time resume in the order they got there.
+    Stops early, closing every task, once should_run() is false.
+    """
+    sleep = sleep or time.sleep
+    order = itertools.count()
+    queue = [(0.0, next(order), task) for task in tasks]
+    heapq.heapify(queue)
+    try:
+        while queue:
+            due, _, task = heapq.heappop(queue)
+            delay = due - time.monotonic()
+            if delay > 0:
+                sleep(delay)
+            if should_run is not None and not should_run():
+                task.close()
+                return
+            try:
+                w = next(task)
+            except StopIteration:
+                continue
+            heapq.heappush(queue, (time.monotonic() + w.seconds, next(order), task))
+    finally:
+        for _, _, task in queue:
+            task.close()
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from metrics import EMIT_BATCH_EVENTS, EMIT_BATCH_SECONDS
+
+# Queued vector updates are sent at most this long after they were reported (seconds)
+BATCH_WINDOW = 0.05
+# Most points merged into one batched message
+BATCH_MAX = 500
+# Queue depth at which the reporting test has to send the backlog itself
+MAX_PENDING = 5000
+
+
+class EventEmitter:
+    """
+    Sits between report_callback and Socket.IO (sending to `room`, if given, else to everyone).
+    Events are queued and sent in order; consecutive vector "update" points of the
+    same (unit, test) are merged into one "test_update" message whose 'results'
+    holds the points ('result' keeps the last one). Any other event flushes the
+    queue straight away, so "new test" and "test end" are never delayed or reordered.
+    on_sent(events), if given, is called with each flushed batch right after it was sent.
+    With a run_id, every test_update message carries it as "runId", so a client
+    that is in more than one run's room can tell the runs' events apart.
+    """
+
+    def __init__(self, socketio, room=None, window=BATCH_WINDOW, max_batch=BATCH_MAX, max_pending=MAX_PENDING,
+                 on_sent=None, run_id=None):
+        self.socketio = socketio
+        self.room = room
+        self.run_id = run_id
+        self.on_sent = on_sent
+        self.window = window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._flushing = False  # a _flush_loop task is running
+
+    def emit(self, result):
+        """Queue one test_update event."""
+        is_point = result.get("message type") == "update" and result.get("result type") == "vector"
+        with self._lock:
+            self._queue.append(result)
+            pending = len(self._queue)
+            start_flusher = is_point and not self._flushing
+            if start_flusher:
+                self._flushing = True
+        if not is_point or pending >= self.max_pending:
+            # backpressure: a producer that outruns the flusher pays for sending
+            self.flush()
+        if start_flusher:
+            self.socketio.start_background_task(self._flush_loop)
+
+    def send(self, event, data):
+        """Emit any other Socket.IO event after everything queued before it."""
+        self.flush()
+        self._emit(event, data)
+
+    def flush(self):
+        with self._send_lock:
+            self._send_queued()
+
+    @contextmanager
+    def hold(self):
+        """Send everything queued, then keep further test_update events back until the block ends."""
+        with self._send_lock:
+            self._send_queued()
+            yield
+
+    def _send_queued(self):
+        # called with self._send_lock held
+        with self._lock:
+            events = list(self._queue)
+            self._queue.clear()
+        if not events:
+            return
+        start = time.perf_counter()
+        for msg in self._coalesce(events):
+            if self.run_id is not None:
+                msg = dict(msg, runId=self.run_id)  # the queued events are also the run's records
+            self._emit("test_update", msg)
+        EMIT_BATCH_SECONDS.observe(time.perf_counter() - start)
+        EMIT_BATCH_EVENTS.observe(len(events))
+        if self.on_sent:
+            self.on_sent(events)
+
+    def _emit(self, event, data):
+        if self.room is None:
+            self.socketio.emit(event, data)
+        else:
+            self.socketio.emit(event, data, to=self.room)
+
+    def _flush_loop(self):
+        while True:
+            self.socketio.sleep(self.window)
+            with self._lock:
+                if not self._queue:
+                    # idle: the next queued point starts a new loop
+                    self._flushing = False
+                    return
+            self.flush()
+
+    def _coalesce(self, events):
+        batch = None
+        for e in events:
+            mergeable = e.get("message type") == "update" and e.get("result type") == "vector"
+            if batch is not None and mergeable \
+                    and (e.get("unit index"), e.get("test name")) == (batch["unit index"], batch["test name"]) \
+                    and len(batch["results"]) < self.max_batch:
+                batch["results"].append(e.get("result"))
+                batch["result"] = e.get("result")
+                batch["pass"] = e.get("pass")
+                continue
+            if batch is not None:
+                yield batch
+                batch = None
+            if mergeable:
+                batch = dict(e)
+                batch["results"] = [e.get("result")]
+            else:
+                yield e
+        if batch is not None:
+            yield batch
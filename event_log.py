@@ -0,0 +1,79 @@
+import glob
+import json
+import os
+import sys
+import threading
+import pandas as pd
+
+LOG_DIR = "logs"
+# Start a new segment file once the current one grows past this many bytes
+ROTATE_BYTES = 64 * 1024 * 1024
+
+
+class EventLog:
+    """
+    Append-only JSONL journal of every event seen during a run.
+    Events are written one line each as they arrive, into numbered segment
+    files under logs/<run name>/ that rotate at ROTATE_BYTES.
+    """
+
+    def __init__(self, run_name, log_dir=LOG_DIR, rotate_bytes=ROTATE_BYTES):
+        self.dir = os.path.join(log_dir, run_name)
+        self.rotate_bytes = rotate_bytes
+        os.makedirs(self.dir, exist_ok=True)
+        # Continue after any segments already on disk for this run
+        self._segment = max(len(glob.glob(os.path.join(self.dir, "events_*.jsonl"))) - 1, 0)
+        self._file = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def append(self, event):
+        line = json.dumps(event, default=str) + "\n"
+        with self._lock:
+            if self._file is None or self._size >= self.rotate_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._size += len(line)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        self._segment += 1
+        path = os.path.join(self.dir, f"events_{self._segment:04d}.jsonl")
+        self._file = open(path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+
+
+def read_events(run_dir):
+    """Yield the events of a run directory in the order they were logged."""
+    for path in sorted(glob.glob(os.path.join(run_dir, "events_*.jsonl"))):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def export_xlsx(run_dir, out_path):
+    """Write a run's event log to a single-sheet xlsx (the old full_log.xlsx layout)."""
+    pd.DataFrame(list(read_events(run_dir))).to_excel(out_path, index=False)
+    return out_path
+
+
+if __name__ == "__main__":
+    # python event_log.py logs/<run name> [full_log.xlsx]
+    if len(sys.argv) < 2:
+        print("usage: python event_log.py <run log dir> [out.xlsx]")
+        sys.exit(1)
+    out = sys.argv[2] if len(sys.argv) > 2 else "full_log.xlsx"
+    print(export_xlsx(sys.argv[1], out))
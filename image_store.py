@@ -0,0 +1,136 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+IMAGE_CACHE_DIR = os.path.join("images", "cas")
+# Total bytes kept in the store before least-recently-used images are evicted
+IMAGE_CACHE_BUDGET = 1024 * 1024 * 1024
+IMAGE_URL_PREFIX = "http://localhost:5000/images/cas/"
+# Full-resolution originals linked from result workbooks; never evicted, so the links keep working
+IMAGE_ORIGINALS_DIR = os.path.join("images", "originals")
+IMAGE_ORIGINALS_URL_PREFIX = "http://localhost:5000/images/originals/"
+
+_MAGIC = [
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tif"),
+    (b"MM\x00*", "tif"),
+]
+
+
+def image_ext(data):
+    for magic, ext in _MAGIC:
+        if data.startswith(magic):
+            return ext
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "bin"
+
+
+class ImageStore:
+    """
+    Content-addressed image files: images/cas/<sha256>.<ext>, holding the
+    original encoded bytes. The same image is only ever stored once; the
+    least recently used files are evicted once the store exceeds its budget
+    (never, if the budget is None).
+    """
+
+    def __init__(self, root=IMAGE_CACHE_DIR, budget=IMAGE_CACHE_BUDGET, url_prefix=IMAGE_URL_PREFIX):
+        self.root = root
+        self.budget = budget
+        self.url_prefix = url_prefix
+        self._lru: OrderedDict[str, int] = OrderedDict()  # file name -> size, oldest first
+        self._total = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        # last access is kept in the files' mtime, so LRU order survives restarts
+        entries = sorted(
+            (e for e in os.scandir(root) if e.is_file() and not e.name.endswith(".tmp")),
+            key=lambda e: e.stat().st_mtime,
+        )
+        for e in entries:
+            size = e.stat().st_size
+            self._lru[e.name] = size
+            self._total += size
+
+    def put(self, data: bytes, name=None) -> str:
+        """Store image bytes (if not already there) and return their file name (their hash unless given)."""
+        name = name or f"{hashlib.sha256(data).hexdigest()}.{image_ext(data)}"
+        path = os.path.join(self.root, name)
+        with self._lock:
+            if name in self._lru or os.path.exists(path):
+                self._touch(name, path)
+                return name
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._lru[name] = len(data)
+            self._total += len(data)
+            self._evict(keep=name)
+        return name
+
+    def url(self, name):
+        return self.url_prefix + name
+
+    def path(self, name):
+        """Local path of a stored image (marking it as recently used), or None."""
+        path = os.path.join(self.root, os.path.basename(name))
+        with self._lock:
+            if not os.path.exists(path):
+                if name in self._lru:
+                    self._total -= self._lru.pop(name)
+                return None
+            self._touch(name, path)
+        return path
+
+    def _touch(self, name, path):
+        if name not in self._lru:
+            # written by another process sharing the directory
+            size = os.path.getsize(path)
+            self._lru[name] = size
+            self._total += size
+        self._lru.move_to_end(name)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self, keep):
+        while self.budget is not None and self._total > self.budget and len(self._lru) > 1:
+            name, size = next(iter(self._lru.items()))
+            if name == keep:
+                break
+            del self._lru[name]
+            self._total -= size
+            try:
+                os.remove(os.path.join(self.root, name))
+            except OSError:
+                pass
+
+
+_store = None
+_originals = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ImageStore:
+    """The process-wide image store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ImageStore()
+        return _store
+
+
+def get_originals() -> ImageStore:
+    """The process-wide store of result images linked from workbooks (never evicted)."""
+    global _originals
+    with _store_lock:
+        if _originals is None:
+            _originals = ImageStore(root=IMAGE_ORIGINALS_DIR, budget=None, url_prefix=IMAGE_ORIGINALS_URL_PREFIX)
+        return _originals
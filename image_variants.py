@@ -0,0 +1,188 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image, UnidentifiedImageError
+from image_store import ImageStore
+from offload import offload
+
+IMAGE_VARIANT_DIR = os.path.join("images", "variants")
+# Resized variants kept in memory / on disk before least-recently-used ones are dropped (bytes)
+VARIANT_MEMORY_BUDGET = 64 * 1024 * 1024
+VARIANT_DISK_BUDGET = 512 * 1024 * 1024
+# Requested sizes are rounded up to a multiple of this and capped, so clients can't make endless variants
+VARIANT_SIZE_STEP = 32
+VARIANT_MAX_SIZE = 4096
+VARIANT_QUALITY = 80
+# format query value -> (Pillow format, mimetype, file extension)
+VARIANT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "jpg": ("JPEG", "image/jpeg", "jpg"),
+    "png": ("PNG", "image/png", "png"),
+    "webp": ("WEBP", "image/webp", "webp"),
+}
+# Source files remembered by (path, mtime, size) -> content hash, and variant keys
+# remembered as needing no conversion (the source is sent as it is)
+SOURCE_MEMO_SIZE = 1024
+
+
+class Variant:
+    """What to send for an image request: the bytes or a file, with its type and (strong) ETag."""
+
+    def __init__(self, etag, mimetype=None, data=None, path=None):
+        self.etag = etag
+        self.mimetype = mimetype
+        self.data = data
+        self.path = path
+
+
+def _size(value):
+    if value is None or value == "":
+        return None
+    n = int(value)
+    if n <= 0:
+        raise ValueError("image sizes must be positive")
+    return min(-(-n // VARIANT_SIZE_STEP) * VARIANT_SIZE_STEP, VARIANT_MAX_SIZE)
+
+
+class ImageVariants:
+    """
+    Resized / re-encoded versions of served images (e.g. /images/x.jpg?w=320&format=webp).
+    A variant is made once and then kept in a memory LRU and in an on-disk one
+    (images/variants), each with its own byte budget. ETags are derived from the
+    source's content hash, so they only change when the image itself does.
+    """
+
+    def __init__(self, root=IMAGE_VARIANT_DIR, memory_budget=VARIANT_MEMORY_BUDGET, disk_budget=VARIANT_DISK_BUDGET):
+        self.disk = ImageStore(root=root, budget=disk_budget)
+        self.memory_budget = memory_budget
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_total = 0
+        self._sources: OrderedDict[tuple, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._making: dict[str, threading.Lock] = {}
+        self._unchanged: OrderedDict[str, None] = OrderedDict()  # variant keys that would just be the source
+
+    def get(self, path, width=None, height=None, fmt=None, digest=None):
+        """
+        The Variant to send for the image file at path, resized to fit width x height
+        (never enlarged) and/or converted to fmt. digest is the source's content hash
+        if already known (image store names). Raises ValueError for bad parameters.
+        """
+        width, height = _size(width), _size(height)
+        fmt = fmt.lower() if fmt else None
+        if fmt is not None and fmt not in VARIANT_FORMATS:
+            raise ValueError(f"unsupported image format: {fmt}")
+        digest = digest or self._digest(path)
+        if width is None and height is None and fmt is None:
+            return Variant(f"{digest}", path=path)
+
+        pil_format, mimetype, ext = VARIANT_FORMATS[fmt] if fmt else (None, None, None)
+        key = f"{digest}_{width or 0}x{height or 0}.{ext or 'src'}"
+        data = self._cached(key)
+        if data is None and key not in self._unchanged:
+            with self._lock:
+                making = self._making.setdefault(key, threading.Lock())
+            with making:  # concurrent requests for the same variant make it once
+                data = self._cached(key)
+                if data is None and key not in self._unchanged:
+                    data = offload(self._make, path, width, height, pil_format)
+                    if data is None:
+                        with self._lock:
+                            self._unchanged[key] = None
+                            while len(self._unchanged) > SOURCE_MEMO_SIZE:
+                                self._unchanged.popitem(last=False)
+                    else:
+                        self.disk.put(data, name=key)
+                        self._remember(key, data)
+            with self._lock:
+                self._making.pop(key, None)
+        if data is None:
+            return Variant(digest, path=path)
+        if mimetype is None:
+            mimetype = Image.MIME.get(Image.open(BytesIO(data)).format, "application/octet-stream")
+        return Variant(key, mimetype, data=data)
+
+    def _digest(self, path):
+        st = os.stat(path)
+        src = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            digest = self._sources.get(src)
+            if digest is not None:
+                self._sources.move_to_end(src)
+                return digest
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._sources[src] = digest
+            while len(self._sources) > SOURCE_MEMO_SIZE:
+                self._sources.popitem(last=False)
+        return digest
+
+    def _cached(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        path = self.disk.path(key)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        self._remember(key, data)
+        return data
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_budget:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = data
+            self._memory_total += len(data)
+            while self._memory_total > self.memory_budget:
+                _, old = self._memory.popitem(last=False)
+                self._memory_total -= len(old)
+
+    @staticmethod
+    def _make(path, width, height, pil_format):
+        try:
+            with Image.open(path) as im:
+                bound = (width or im.width, height or im.height)
+                smaller = bound[0] < im.width or bound[1] < im.height
+                if not smaller and pil_format in (None, im.format):
+                    return None  # nothing to do: send the source
+                pil_format = pil_format or im.format
+                if smaller:
+                    im.draft("RGB", bound)  # JPEGs decode straight at a reduced scale
+                    im.thumbnail(bound)
+                else:
+                    im.load()
+                if pil_format == "JPEG" and im.mode not in ("RGB", "L"):
+                    im = im.convert("RGB")
+                out = BytesIO()
+                if pil_format in ("JPEG", "WEBP"):
+                    im.save(out, pil_format, quality=VARIANT_QUALITY)
+                else:
+                    im.save(out, pil_format)
+                return out.getvalue()
+        except (UnidentifiedImageError, KeyError, OSError) as e:
+            raise ValueError(f"cannot convert this image: {e}")
+
+
+_variants = None
+_variants_lock = threading.Lock()
+
+
+def get_variants() -> ImageVariants:
+    """The process-wide image variant cache."""
+    global _variants
+    with _variants_lock:
+        if _variants is None:
+            _variants = ImageVariants()
+        return _variants
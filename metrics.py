@@ -0,0 +1,137 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds (seconds)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+TIMING_SHEET = "Timing"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in the shape Prometheus expects."""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        key = tuple("" if v is None else str(v) for v in label_values)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for key, values in sorted(series.items()):
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets, values):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_number(values[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {values[-1]}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Everything in the Prometheus text exposition format."""
+        return "\n".join(m.render() for m in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+TEST_FUNCTION_SECONDS = REGISTRY.histogram(
+    "test_function_seconds", "Duration of one test function call.", ("test", "function", "unit"))
+PHASE_SECONDS = REGISTRY.histogram(
+    "plan_phase_seconds", "Duration of one exec_order phase of a run.", ("kind", "exec_order"))
+SAVE_SECONDS = REGISTRY.histogram(
+    "save_results_seconds", "Time save_results spent queueing a test's results (caller side).")
+WRITER_SECONDS = REGISTRY.histogram(
+    "result_writer_seconds", "Time the result writer spent on one job (open/write/flush/close/export).",
+    ("job",))
+EMIT_BATCH_SECONDS = REGISTRY.histogram(
+    "emit_batch_seconds", "Time to send one flush of queued Socket.IO events.")
+EMIT_BATCH_EVENTS = REGISTRY.histogram(
+    "emit_batch_events", "Reported events sent in one flush.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000))
+
+
+class RunTimings:
+    """
+    Every timed step of one run, kept so it can be written into the unit's
+    result file as a "Timing" sheet (unit None = once-only tests and phases).
+    """
+
+    COLUMNS = ["kind", "name", "unit index", "exec order", "start (s)", "duration (s)"]
+
+    def __init__(self, rows=()):
+        """rows: those of an earlier part of the run (e.g. before it was resumed); the clock continues after them."""
+        self._rows = [tuple(r) for r in rows]
+        elapsed = max((r[4] + r[5] for r in self._rows), default=0.0)
+        self.started = time.monotonic() - elapsed
+        self._lock = threading.Lock()
+
+    def add(self, kind, name, unit, exec_order, start, seconds):
+        with self._lock:
+            self._rows.append((kind, name, unit, exec_order, round(start - self.started, 6), round(seconds, 6)))
+
+    def rows(self):
+        with self._lock:
+            return [list(r) for r in self._rows]
+
+    def extend(self, rows):
+        """Add rows taken with rows() elsewhere (e.g. on a station worker); their times stay as they were."""
+        with self._lock:
+            self._rows.extend(tuple(r) for r in rows)
+
+    def rows_for(self, unit):
+        """Rows for one unit's sheet: its own steps plus the run-wide ones, in start order."""
+        with self._lock:
+            rows = [list(r) for r in self._rows if r[2] is None or r[2] == unit]
+        rows.sort(key=lambda r: r[4])
+        return rows
@@ -0,0 +1,14 @@
+import sys
+
+
+def offload(fn, *args):
+    """
+    Run fn in a real OS thread when eventlet has green-patched threading, else inline.
+    fn must not take locks that greenlets also take: a green lock handed over from a
+    greenlet to a tpool thread (or back) breaks the hub.
+    """
+    eventlet = sys.modules.get("eventlet")
+    if eventlet is not None and eventlet.patcher.is_monkey_patched("thread"):
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    return fn(*args)
@@ -0,0 +1,171 @@
+import json
+import os
+from image_store import IMAGE_ORIGINALS_URL_PREFIX
+from result_writer import ResultWriter, SheetData, cell_value, new_workbook, put_sheet, save_workbook
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed when RESULTS_BACKEND = "parquet"
+    pa = None
+    pq = None
+
+# Generate each unit's xlsx from its Parquet files when the run is closed
+EXPORT_XLSX_ON_CLOSE = True
+MANIFEST = "manifest.json"
+
+
+def unit_dir(xlsx_path):
+    """Directory holding a unit's Parquet results: the workbook path without its extension."""
+    return os.path.splitext(xlsx_path)[0]
+
+
+def _column(values):
+    """Arrow array for one sheet column, typed like the cells openpyxl would write."""
+    present = [v for v in values if v is not None]
+    try:
+        if present and all(isinstance(v, bool) for v in present):
+            return pa.array(values, pa.bool_())
+        if present and all(isinstance(v, int) and not isinstance(v, bool) for v in present):
+            return pa.array(values, pa.int64())
+        if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+            return pa.array([None if v is None else float(v) for v in values], pa.float64())
+    except (OverflowError, pa.ArrowInvalid):
+        pass
+    return pa.array([None if v is None else str(cell_value(v)) for v in values], pa.string())
+
+
+def _write_table(table, path):
+    tmp = path + ".tmp"
+    pq.write_table(table, tmp)
+    os.replace(tmp, path)
+
+
+def _write_manifest(root, manifest):
+    path = os.path.join(root, MANIFEST)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, default=str)
+    os.replace(tmp, path)
+
+
+def read_manifest(root):
+    with open(os.path.join(root, MANIFEST), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _original_url(entry):
+    # manifests written before the URL was recorded only have the original's store name
+    if entry.get("original_url") or not entry.get("original"):
+        return entry.get("original_url")
+    return IMAGE_ORIGINALS_URL_PREFIX + entry["original"]
+
+
+def export_workbook(root, out_path):
+    """Build the unit's xlsx (same sheets and order as the xlsx backend) from its Parquet files."""
+    manifest = read_manifest(root)
+    wb = new_workbook(manifest["details"])
+    for entry in manifest["sheets"]:
+        table = pq.read_table(os.path.join(root, entry["file"]))
+        columns = [table.column(c).to_pylist() for c in table.column_names]
+        put_sheet(wb, SheetData(entry["name"], table.column_names, zip(*columns),
+                                image_path=entry.get("image_path"),
+                                image_missing=entry.get("image_missing"),
+                                thumbnail=entry.get("thumbnail"),
+                                original=entry.get("original"),
+                                original_url=_original_url(entry)))
+    save_workbook(wb, out_path)
+    return out_path
+
+
+class _UnitDir:
+    def __init__(self, path, root, manifest):
+        self.path = path
+        self.root = root
+        self.manifest = manifest
+
+
+class ParquetResultWriter(ResultWriter):
+    """
+    ResultWriter that keeps each unit's results as one Parquet file per test sheet,
+    in a directory next to where the unit's workbook goes, plus a manifest with the
+    Details row and the sheet order. Every finished test is written straight away;
+    the xlsx is only built from these files at close (EXPORT_XLSX_ON_CLOSE) or
+    through export(), and on_saved reports that workbook's path each time.
+    """
+
+    def __init__(self, *args, export_on_close=EXPORT_XLSX_ON_CLOSE, **kwargs):
+        if pa is None:
+            raise RuntimeError("The parquet results backend needs pyarrow")
+        super().__init__(*args, **kwargs)
+        self.export_on_close = export_on_close
+
+    def export(self, unit_idx, path):
+        """Generate the unit's workbook at path from its Parquet files; returns path, or None."""
+        if not os.path.exists(os.path.join(unit_dir(path), MANIFEST)) and not self.has_unit(unit_idx):
+            return None
+        self._submit(self._export, unit_idx, path)
+        self.wait()
+        return path if os.path.exists(path) else None
+
+    # --- worker side ---
+
+    def _open(self, unit_idx, path, details):
+        if unit_idx in self._books:
+            return []
+        root = unit_dir(path)
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(os.path.join(root, MANIFEST)):
+            manifest = read_manifest(root)
+        else:
+            manifest = {"details": details, "sheets": []}
+            _write_manifest(root, manifest)
+        self._books[unit_idx] = _UnitDir(path, root, manifest)
+        return []
+
+    def _write(self, unit_idx, sheet):
+        book = self._books[unit_idx]
+        rows = list(sheet.rows)
+        columns = [list(c) for c in zip(*rows)] if rows else [[] for _ in sheet.columns]
+        table = pa.table([_column(c) for c in columns], names=sheet.columns)
+        file_name = f"{sheet.name}.parquet"
+        _write_table(table, os.path.join(book.root, file_name))
+
+        entry = {"name": sheet.name, "file": file_name,
+                 "image_path": sheet.image_path, "image_missing": sheet.image_missing,
+                 "thumbnail": sheet.thumbnail, "original": sheet.original,
+                 "original_url": sheet.original_url}
+        sheets = book.manifest["sheets"]
+        for i, old in enumerate(sheets):
+            if old["name"] == sheet.name:
+                sheets[i] = entry
+                break
+        else:
+            sheets.append(entry)
+        _write_manifest(book.root, book.manifest)
+        # on_saved is for the unit's workbook, which only exists once it is exported
+        return []
+
+    def _due_in(self):
+        return None  # every sheet is written as soon as it arrives
+
+    def _flush(self, unit_idx):
+        # every sheet is already on disk
+        return []
+
+    def _mark(self, unit_idx, token):
+        self._durable.append((unit_idx, [token]))
+        return []
+
+    def _close(self, unit_idx):
+        saved = []
+        if self.export_on_close:
+            for u, book in self._books.items():
+                export_workbook(book.root, book.path)
+                saved.append((u, book.path))
+        self._books.clear()
+        return saved
+
+    def _export(self, unit_idx, path):
+        export_workbook(unit_dir(path), path)
+        return [(unit_idx, path)]
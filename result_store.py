@@ -0,0 +1,323 @@
+import numbers
+import os
+import pickle
+import threading
+from array import array
+
+try:
+    import fcntl
+except ImportError:  # Windows: a file another process has open can't be removed anyway
+    fcntl = None
+
+SPILL_DIR = os.path.join("logs", "spill")
+# In-memory window of each (unit, test) record: once a vector column holds more than
+# MEMORY_WINDOW_BYTES, or an event list / non-numeric column more than MEMORY_WINDOW_ITEMS,
+# what it holds is appended to the run's spill file and only read back when iterated
+MEMORY_WINDOW_BYTES = 4 * 1024 * 1024
+MEMORY_WINDOW_ITEMS = 20000
+
+
+class SpillFile:
+    """
+    Append-only file a run's records move their older values into. Each write is
+    one chunk, read back by (offset, length); the file is created on first use and
+    kept open (with a shared lock where there is flock) until it is removed, which
+    is how a sweep tells it from a file left behind by a dead process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes):
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "ab")
+                if fcntl is not None:
+                    fcntl.flock(self._file, fcntl.LOCK_SH)
+            offset = self._file.tell()
+            self._file.write(data)
+            self._file.flush()
+        return offset, len(data)
+
+    def read(self, offset, length):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def remove(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def _remove_if_unused(path):
+    """Remove a spill file unless some process still has it open; True if it was removed."""
+    try:
+        if fcntl is not None:
+            with open(path, "rb") as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+class Column:
+    """
+    Growable column of vector values. Starts as array('q') and is promoted to
+    array('d') on the first float, or to a plain list on the first non-number.
+    With a spill file, values beyond the memory window are moved there in chunks;
+    len() and iteration still cover every value, in order.
+    """
+
+    def __init__(self, spill=None):
+        self.data = array('q')
+        self.spill = spill
+        self._chunks = []  # (offset, length, typecode or None for pickled lists, count)
+        self._spilled = 0
+
+    def append(self, v):
+        data = self.data
+        if isinstance(data, array):
+            if isinstance(v, bool) or not isinstance(v, numbers.Real):
+                data = self.data = list(data)
+            elif data.typecode == 'q' and not isinstance(v, numbers.Integral):
+                data = self.data = array('d', data)
+            try:
+                data.append(v)
+            except OverflowError:
+                # integers that don't fit in 64 bits
+                data = self.data = list(data)
+                data.append(v)
+        else:
+            data.append(v)
+        if self.spill is not None:
+            if len(data) * data.itemsize > MEMORY_WINDOW_BYTES if isinstance(data, array) \
+                    else len(data) > MEMORY_WINDOW_ITEMS:
+                self._spill()
+
+    def _spill(self):
+        data = self.data
+        if isinstance(data, array):
+            offset, length = self.spill.write(data.tobytes())
+            self._chunks.append((offset, length, data.typecode, len(data)))
+            self.data = array(data.typecode)
+        else:
+            offset, length = self.spill.write(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+            self._chunks.append((offset, length, None, len(data)))
+            self.data = []
+        self._spilled += len(data)
+
+    def _load(self, chunk):
+        offset, length, typecode, _ = chunk
+        raw = self.spill.read(offset, length)
+        if typecode is None:
+            return pickle.loads(raw)
+        values = array(typecode)
+        values.frombytes(raw)
+        return values
+
+    def __len__(self):
+        return self._spilled + len(self.data)
+
+    def __iter__(self):
+        # spilled chunks are read back one at a time, so iterating stays flat in memory
+        for chunk in list(self._chunks):
+            yield from self._load(chunk)
+        yield from self.data
+
+    def tolist(self):
+        return list(self)
+
+
+class EventList:
+    """
+    Append-only list of event dicts that spills to the run's spill file (pickled,
+    MEMORY_WINDOW_ITEMS at a time) when given one. Iterates in order over all of them.
+    """
+
+    def __init__(self, spill=None):
+        self.spill = spill
+        self._memory = []
+        self._chunks = []  # (offset, length, count)
+        self._spilled = 0
+
+    def append(self, event):
+        self._memory.append(event)
+        if self.spill is not None and len(self._memory) > MEMORY_WINDOW_ITEMS:
+            offset, length = self.spill.write(pickle.dumps(self._memory, pickle.HIGHEST_PROTOCOL))
+            self._chunks.append((offset, length, len(self._memory)))
+            self._spilled += len(self._memory)
+            self._memory = []
+
+    def __len__(self):
+        return self._spilled + len(self._memory)
+
+    def __iter__(self):
+        for offset, length, _ in list(self._chunks):
+            yield from pickle.loads(self.spill.read(offset, length))
+        yield from self._memory
+
+    def last(self):
+        if self._memory:
+            return self._memory[-1]
+        if self._chunks:
+            offset, length, _ = self._chunks[-1]
+            return pickle.loads(self.spill.read(offset, length))[-1]
+        return None
+
+
+class TestRecord:
+    """
+    Everything reported for one test on one unit: the new-test metadata, its updates
+    and the end event. Given a spill file, long update streams and vectors keep only
+    their most recent part in memory (see MEMORY_WINDOW_BYTES / MEMORY_WINDOW_ITEMS).
+    """
+
+    def __init__(self, run_id, unit_idx, test_name, result_type=None, spill=None):
+        self.run_id = run_id
+        self.unit_idx = unit_idx
+        self.test_name = test_name
+        self.result_type = result_type
+        self.spill = spill
+        self.new = None
+        self.updates = EventList(spill)
+        self.end = None
+        self.other = EventList(spill)
+        # vector points are kept as x/y columns rather than one event per point
+        self.x = Column(spill)
+        self.y = Column(spill)
+        self.last_point = None
+
+    def add(self, event):
+        mtype = event.get("message type")
+        if mtype == "new test":
+            if self.new is not None:
+                # the test is being run again: start a fresh record
+                self.updates = EventList(self.spill)
+                self.end = None
+                self.other = EventList(self.spill)
+                self.x = Column(self.spill)
+                self.y = Column(self.spill)
+                self.last_point = None
+            self.new = event
+        elif mtype == "update":
+            point = event.get("result")
+            if (self.result_type or "").lower() == "vector" \
+                    and isinstance(point, (list, tuple)) and len(point) >= 2:
+                self.x.append(point[0])
+                self.y.append(point[1])
+                self.last_point = event
+            else:
+                self.updates.append(event)
+        elif mtype == "test end":
+            self.end = event
+        else:
+            self.other.append(event)
+
+    def first(self):
+        """The new-test event, or the earliest event we have."""
+        return self.new or next(self.iter_events(), None)
+
+    def last(self):
+        """The test-end event, or the latest event we have."""
+        for event in (self.end, self.last_point, self.other.last(), self.updates.last()):
+            if event is not None:
+                return event
+        return self.new
+
+    def iter_events(self):
+        """Every event kept, streaming spilled ones back from disk."""
+        if self.new is not None:
+            yield self.new
+        yield from self.updates
+        yield from self.other
+        if self.last_point is not None:
+            yield self.last_point
+        if self.end is not None:
+            yield self.end
+
+    def events(self):
+        return list(self.iter_events())
+
+
+class ResultStore:
+    """
+    Results of every run, indexed by (run, unit index, test name).
+    Looking up or saving a single test only touches that test's record.
+    Each run's records spill what's beyond their memory window into
+    <spill_dir>/<run id>.bin (spill_dir=None keeps everything in memory).
+    """
+
+    def __init__(self, spill_dir=SPILL_DIR):
+        self.spill_dir = spill_dir
+        self._runs: dict[str, dict] = {}
+        self._spills: dict[str, SpillFile] = {}
+        self._lock = threading.Lock()
+
+    def add(self, run_id, event) -> TestRecord:
+        """File an event under its (run, unit, test) record and return the record."""
+        unit_idx = event.get("unit index")
+        test_name = event.get("test name")
+        with self._lock:
+            units = self._runs.setdefault(run_id, {})
+            tests = units.setdefault(unit_idx, {})
+            rec = tests.get(test_name)
+            if rec is None:
+                rec = TestRecord(run_id, unit_idx, test_name, event.get("result type"), self._spill(run_id))
+                tests[test_name] = rec
+        rec.add(event)
+        return rec
+
+    def get(self, run_id, unit_idx, test_name) -> TestRecord | None:
+        return self._runs.get(run_id, {}).get(unit_idx, {}).get(test_name)
+
+    def units(self, run_id):
+        """Unit indexes that reported anything in a run (once-only tests report as None)."""
+        return list(self._runs.get(run_id, {}))
+
+    def tests(self, run_id, unit_idx):
+        """A unit's test records, in the order the tests first reported."""
+        return list(self._runs.get(run_id, {}).get(unit_idx, {}).values())
+
+    def runs(self):
+        return list(self._runs)
+
+    def _spill(self, run_id):
+        # called with self._lock held
+        if self.spill_dir is None:
+            return None
+        spill = self._spills.get(run_id)
+        if spill is None:
+            spill = self._spills[run_id] = SpillFile(os.path.join(self.spill_dir, f"{run_id}.bin"))
+        return spill
+
+    def sweep(self):
+        """
+        Remove spill files no live run uses: those left behind when an earlier
+        process crashed or was restarted. Returns how many were removed.
+        """
+        if self.spill_dir is None:
+            return 0
+        with self._lock:
+            own = {spill.path for spill in self._spills.values()}
+        try:
+            entries = [e for e in os.scandir(self.spill_dir) if e.is_file() and e.name.endswith(".bin")]
+        except FileNotFoundError:
+            return 0
+        return sum(_remove_if_unused(e.path) for e in entries if e.path not in own)
+
+    def drop_run(self, run_id):
+        with self._lock:
+            self._runs.pop(run_id, None)
+            spill = self._spills.pop(run_id, None)
+        if spill is not None:
+            spill.remove()
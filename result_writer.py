@@ -0,0 +1,352 @@
+import os
+import queue
+import threading
+import time
+from io import BytesIO
+from openpyxl import Workbook, load_workbook
+from openpyxl.drawing.image import Image as XLImage
+from openpyxl.styles import Font
+from metrics import WRITER_SECONDS
+from offload import offload
+from image_store import get_originals
+from thumbnails import get_thumbnailer
+
+# Flush policy: a unit's workbook is written to disk after this many finished
+# tests, or once this many seconds have passed since its last flush with sheets
+# still pending (checked by the writer even while no new sheets arrive),
+# whichever comes first. close() always flushes whatever is still pending.
+# Every xlsx flush re-serializes the unit's whole workbook, so its cost grows
+# with the number of sheets already written; the "parquet" backend below writes
+# each finished test on its own and is the one whose per-test cost stays flat.
+FLUSH_EVERY_TESTS = 5
+FLUSH_EVERY_SECONDS = 30.0
+
+# How a run's results are persisted while it executes:
+#   "xlsx"    - one openpyxl workbook per unit (the original layout)
+#   "parquet" - one Parquet file per test sheet (needs pyarrow); the unit's xlsx
+#               is generated from them when the run ends, or on demand
+RESULTS_BACKEND = "xlsx"
+
+
+def excel_sheet_name(test_name):
+    """Excel-safe sheet name for a test (31 chars, no []:?*\\/)."""
+    sheet = test_name[:31]
+    for ch in r'[]:?*\/':
+        sheet = sheet.replace(ch, "_")
+    return sheet
+
+
+def cell_value(val):
+    """Convert a value the same way pandas' to_excel does for openpyxl."""
+    if val is None or isinstance(val, (bool, int, float, str)):
+        return val
+    if hasattr(val, "isoformat"):
+        return val
+    return str(val)
+
+
+def make_writer(backend=None, **kwargs):
+    """The ResultWriter for a results backend (RESULTS_BACKEND by default)."""
+    backend = backend or RESULTS_BACKEND
+    if backend == "parquet":
+        from parquet_writer import ParquetResultWriter, pa
+        if pa is not None:
+            return ParquetResultWriter(**kwargs)
+        print("pyarrow is not installed; saving results as xlsx")
+    elif backend != "xlsx":
+        raise ValueError(f"Unknown results backend: {backend}")
+    return ResultWriter(**kwargs)
+
+
+class SheetData:
+    """
+    One finished test sheet: a header row, data rows and an optional image.
+    thumbnail / original / original_url are filled in by prepare_image: the file
+    to embed, and the image store name and URL of the full-resolution original
+    it links to. put_sheet only reads them, so it takes no locks.
+    """
+
+    def __init__(self, name, columns, rows, image_path=None, image_missing=None, thumbnail=None, original=None,
+                 original_url=None):
+        self.name = name
+        self.columns = list(columns)
+        self.rows = rows
+        self.image_path = image_path
+        self.image_missing = image_missing
+        self.thumbnail = thumbnail
+        self.original = original
+        self.original_url = original_url
+
+
+def prepare_image(sheet: SheetData):
+    """
+    Make the sheet's thumbnail and store its original. Call it on the caller's side,
+    never inside an offloaded job: the thumbnailer and the image stores take locks
+    that request handlers take too.
+    """
+    if not sheet.image_path or sheet.original is not None:
+        return
+    try:
+        sheet.thumbnail, sheet.original = get_thumbnailer().embed(sheet.image_path)
+        sheet.original_url = get_originals().url(sheet.original)
+    except OSError as e:
+        print(f"Could not store image {sheet.image_path}: {e}")
+
+
+def new_workbook(details):
+    """A workbook holding only the Details sheet."""
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Details"
+    _fill(ws, list(details.keys()), [list(details.values())])
+    return wb
+
+
+def put_sheet(wb, sheet: SheetData):
+    """Add a test sheet to a workbook, replacing (in place) one with the same name."""
+    if sheet.name in wb.sheetnames:
+        pos = wb.sheetnames.index(sheet.name)
+        del wb[sheet.name]
+        ws = wb.create_sheet(sheet.name, pos)
+    else:
+        ws = wb.create_sheet(sheet.name)
+    _fill(ws, sheet.columns, sheet.rows)
+    if sheet.original_url:
+        # a bounded thumbnail is embedded; the full-resolution original is linked next to the header row
+        ws.add_image(XLImage(sheet.thumbnail), "A3")
+        col = len(sheet.columns) + 1
+        ws.cell(row=1, column=col, value="original").font = Font(bold=True)
+        link = ws.cell(row=2, column=col, value=sheet.original_url)
+        link.hyperlink = sheet.original_url
+        link.style = "Hyperlink"
+    elif sheet.image_path:
+        # not prepared (or it couldn't be stored): embed the file as it is
+        ws.add_image(XLImage(sheet.image_path), "A3")
+    elif sheet.image_missing:
+        ws.cell(row=3, column=1, value=sheet.image_missing)
+
+
+def save_workbook(wb, path):
+    # write next to the target, then swap it in, so a crash never leaves a torn file
+    tmp = path + ".tmp"
+    wb.save(tmp)
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _fill(ws, columns, rows):
+    ws.append(columns)
+    for cell in ws[1]:
+        cell.font = Font(bold=True)
+    for row in rows:
+        ws.append([cell_value(v) for v in row])
+
+
+class _ImageBytes(BytesIO):
+    """Image data of a reopened workbook: openpyxl closes it after each save, so just rewind instead."""
+
+    def close(self):
+        self.seek(0)
+
+
+def open_workbook(path):
+    """Load an existing result workbook so that it can be saved again and again."""
+    wb = load_workbook(path)
+    for ws in wb.worksheets:
+        for image in ws._images:
+            if isinstance(image.ref, BytesIO):
+                image.ref = _ImageBytes(image.ref.getvalue())
+    return wb
+
+
+class _UnitBook:
+    def __init__(self, path, workbook):
+        self.path = path
+        self.workbook = workbook
+        self.pending = 0
+        self.last_flush = time.monotonic()
+        self.marks = []  # mark() tokens waiting for the next save
+
+
+class ResultWriter:
+    """
+    Keeps one live openpyxl workbook per unit for the whole run.
+    Finished test sheets are added in memory and the workbook is only
+    serialized to disk according to the flush policy.
+
+    All workbook work happens on a single background worker, in call order, so
+    callers only pay for queueing a job. Under eventlet the worker hands each job
+    to a real OS thread (tpool), so openpyxl never blocks the event loop. While
+    idle, the worker also saves any unit whose pending sheets have waited longer
+    than flush_every_seconds.
+    on_saved(unit_idx, path) / on_error(unit_idx, exc) / on_durable(unit_idx, tokens)
+    are called from the worker.
+    """
+
+    def __init__(self, flush_every_tests=FLUSH_EVERY_TESTS, flush_every_seconds=FLUSH_EVERY_SECONDS,
+                 on_saved=None, on_error=None, on_durable=None):
+        self.flush_every_tests = flush_every_tests
+        self.flush_every_seconds = flush_every_seconds
+        self.on_saved = on_saved
+        self.on_error = on_error
+        self.on_durable = on_durable
+        self._durable = []  # (unit_idx, tokens) released by the last job, only touched by the worker
+        self._books: dict[int, _UnitBook] = {}  # only touched by the worker
+        self._units = set()  # units opened so far, as seen by callers
+        self._jobs = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def open_unit(self, unit_idx, path, details):
+        """Start (or reopen) the workbook for a unit, creating its Details sheet."""
+        with self._lock:
+            if unit_idx in self._units:
+                return
+            self._units.add(unit_idx)
+        self._submit(self._open, unit_idx, path, dict(details))
+
+    def has_unit(self, unit_idx):
+        return unit_idx in self._units
+
+    def write_sheet(self, unit_idx, sheet: SheetData):
+        """Add or replace one test sheet, flushing if the policy says so."""
+        prepare_image(sheet)
+        self._submit(self._write, unit_idx, sheet)
+
+    def mark(self, unit_idx, token):
+        """
+        Have on_durable(unit_idx, [token, ...]) called once everything queued for the
+        unit before this call is saved to disk (straight away if it already is).
+        """
+        self._submit(self._mark, unit_idx, token)
+
+    def flush(self, unit_idx=None):
+        """Write pending changes to disk (one unit, or all of them)."""
+        self._submit(self._flush, unit_idx)
+
+    def export(self, unit_idx, path):
+        """Bring a unit's workbook at path up to date on disk; returns path, or None if there is none."""
+        if self.has_unit(unit_idx):
+            self.flush(unit_idx)
+        self.wait()
+        return path if os.path.exists(path) else None
+
+    def wait(self):
+        """Block until every queued job has been written."""
+        self._jobs.join()
+
+    def close(self):
+        """Flush every unit, wait for the writes and forget the in-memory workbooks."""
+        self._submit(self._close, None)
+        self.wait()
+        with self._lock:
+            self._units.clear()
+
+    def _submit(self, fn, unit_idx, *args):
+        with self._lock:
+            self._jobs.put((fn, unit_idx, args))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            try:
+                fn, unit_idx, args = self._jobs.get(timeout=self._due_in())
+            except queue.Empty:
+                # nothing queued, but some pending sheets have waited long enough
+                self._execute(self._flush_due, None)
+                continue
+            try:
+                self._execute(fn, unit_idx, *args)
+            finally:
+                self._jobs.task_done()
+            if fn == self._close:
+                with self._lock:
+                    if self._jobs.empty():
+                        self._worker = None
+                        return
+
+    def _execute(self, fn, unit_idx, *args):
+        try:
+            with WRITER_SECONDS.time(fn.__name__.strip("_")):
+                saved = offload(fn, unit_idx, *args)
+            if self.on_saved:
+                for u, path in saved or []:
+                    self.on_saved(u, path)
+            durable, self._durable = self._durable, []
+            if self.on_durable:
+                for u, tokens in durable:
+                    self.on_durable(u, tokens)
+        except Exception as e:
+            if self.on_error:
+                self.on_error(unit_idx, e)
+            else:
+                print(f"result writer: unit {unit_idx}: {e}")
+
+    def _due_in(self):
+        """Seconds until the oldest pending sheets are due to be flushed, or None if nothing is pending."""
+        pending = [book.last_flush for book in self._books.values() if book.pending]
+        if not pending:
+            return None
+        return max(0.0, min(pending) + self.flush_every_seconds - time.monotonic())
+
+    # --- worker side: each returns the [(unit_idx, path)] it saved ---
+
+    def _open(self, unit_idx, path, details):
+        if unit_idx in self._books:
+            return []
+        wb = open_workbook(path) if os.path.exists(path) else new_workbook(details)
+        book = _UnitBook(path, wb)
+        self._books[unit_idx] = book
+        return self._save(unit_idx, book)
+
+    def _write(self, unit_idx, sheet):
+        book = self._books[unit_idx]
+        put_sheet(book.workbook, sheet)
+
+        book.pending += 1
+        due = time.monotonic() - book.last_flush >= self.flush_every_seconds
+        if book.pending >= self.flush_every_tests or due:
+            return self._save(unit_idx, book)
+        return []
+
+    def _flush(self, unit_idx):
+        units = list(self._books) if unit_idx is None else [unit_idx]
+        saved = []
+        for u in units:
+            book = self._books[u]
+            if book.pending:
+                saved += self._save(u, book)
+        return saved
+
+    def _flush_due(self, unit_idx):
+        now = time.monotonic()
+        saved = []
+        for u, book in self._books.items():
+            if book.pending and now - book.last_flush >= self.flush_every_seconds:
+                saved += self._save(u, book)
+        return saved
+
+    def _close(self, unit_idx):
+        saved = self._flush(None)
+        self._books.clear()
+        return saved
+
+    def _mark(self, unit_idx, token):
+        book = self._books.get(unit_idx)
+        if book is None or not book.pending:
+            self._durable.append((unit_idx, [token]))
+        else:
+            book.marks.append(token)
+        return []
+
+    def _save(self, unit_idx, book):
+        save_workbook(book.workbook, book.path)
+        book.pending = 0
+        book.last_flush = time.monotonic()
+        if book.marks:
+            self._durable.append((unit_idx, book.marks))
+            book.marks = []
+        return [(unit_idx, book.path)]
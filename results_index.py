@@ -0,0 +1,217 @@
+import glob
+import os
+import sqlite3
+import threading
+from result_writer import excel_sheet_name
+
+INDEX_PATH = os.path.join("results", "results_index.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    script TEXT,
+    serial TEXT,
+    operator TEXT,
+    unit_index INTEGER,
+    started_at TEXT,
+    comments TEXT
+);
+CREATE TABLE IF NOT EXISTS test_results (
+    path TEXT NOT NULL REFERENCES result_files(path) ON DELETE CASCADE,
+    sheet TEXT NOT NULL,
+    test_name TEXT NOT NULL,
+    result_type TEXT,
+    pass TEXT,
+    value,
+    result_unit TEXT,
+    expected_range TEXT,
+    points INTEGER,
+    PRIMARY KEY (path, sheet)
+);
+CREATE INDEX IF NOT EXISTS idx_files_serial ON result_files(serial);
+CREATE INDEX IF NOT EXISTS idx_files_script ON result_files(script);
+CREATE INDEX IF NOT EXISTS idx_files_operator ON result_files(operator);
+CREATE INDEX IF NOT EXISTS idx_files_started ON result_files(started_at);
+CREATE INDEX IF NOT EXISTS idx_tests_name ON test_results(test_name);
+CREATE INDEX IF NOT EXISTS idx_tests_sheet ON test_results(sheet);
+CREATE INDEX IF NOT EXISTS idx_tests_pass ON test_results(pass);
+"""
+
+
+def _pass_text(value):
+    if value is None:
+        return None
+    return str(value).strip().lower()
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def _int(value):
+    try:
+        return None if value is None else int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _scalar(value):
+    """SQLite can store these as-is; anything else is kept as text."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+class ResultsIndex:
+    """
+    SQLite index over the per-unit result workbooks: one row per file and one
+    per test in it. save_results keeps it current as it writes; backfill()
+    picks up files written before the index existed (or changed since).
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(_SCHEMA)
+            self._db.commit()
+
+    def record_file(self, path, details, mtime_ns=None):
+        """Add or update a result file from its Details row."""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO result_files (path, mtime_ns, script, serial, operator, unit_index, started_at, comments)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(path) DO UPDATE SET mtime_ns=excluded.mtime_ns, script=excluded.script,"
+                " serial=excluded.serial, operator=excluded.operator, unit_index=excluded.unit_index,"
+                " started_at=excluded.started_at, comments=excluded.comments",
+                (
+                    path, mtime_ns,
+                    _text(details.get("Script Name")),
+                    _text(details.get("Device Serial No.")),
+                    _text(details.get("Operator Name")),
+                    _int(details.get("Unit Index")),
+                    _text(details.get("Date/Time")),
+                    _text(details.get("Additional Comments")),
+                ),
+            )
+            self._db.commit()
+
+    def mark_current(self, path):
+        """Remember a file's mtime after we wrote it ourselves, so backfill() leaves it alone."""
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        with self._lock:
+            self._db.execute("UPDATE result_files SET mtime_ns = ? WHERE path = ?", (mtime_ns, path))
+            self._db.commit()
+
+    def record_test(self, path, test_name, result_type, passed, value=None,
+                    result_unit=None, expected_range=None, points=None):
+        """
+        Add or replace one test's outcome in a result file. Rows are keyed by the
+        test's sheet, since files read back from disk only name some tests by sheet.
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO test_results"
+                " (path, sheet, test_name, result_type, pass, value, result_unit, expected_range, points)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, excel_sheet_name(str(test_name)), test_name, _text(result_type), _pass_text(passed), _scalar(value),
+                 _text(result_unit), _text(expected_range), points),
+            )
+            self._db.commit()
+
+    def query(self, serial=None, script=None, operator=None, test=None,
+              since=None, until=None, passed=None, limit=500):
+        """
+        Test results matching every given filter, newest first. 'test' matches the
+        full test name, its last path component or its sheet name; since/until compare the run's
+        start time as ISO text; passed is "true"/"false".
+        """
+        where, args = [], []
+        for column, value in (("f.serial", serial), ("f.script", script), ("f.operator", operator)):
+            if value:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if test:
+            where.append("(t.test_name = ? OR t.test_name LIKE ? OR t.sheet = ?)")
+            args += [test, f"%/{test}", excel_sheet_name(test)]
+        if since:
+            where.append("f.started_at >= ?")
+            args.append(since)
+        if until:
+            where.append("f.started_at <= ?")
+            args.append(until)
+        if passed is not None and passed != "":
+            where.append("t.pass = ?")
+            args.append(_pass_text(passed))
+        sql = (
+            "SELECT f.path, f.script, f.serial, f.operator, f.unit_index, f.started_at,"
+            " t.test_name, t.result_type, t.pass, t.value, t.result_unit, t.expected_range, t.points"
+            " FROM test_results t JOIN result_files f ON f.path = t.path"
+        )
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY f.started_at DESC, t.test_name LIMIT ?"
+        args.append(int(limit))
+        with self._lock:
+            return [dict(r) for r in self._db.execute(sql, args)]
+
+    def backfill(self, results_dir="results", sleep=None):
+        """
+        Index result workbooks that are new or changed since they were indexed; returns how many.
+        sleep (e.g. socketio.sleep) is called between files to let other tasks run.
+        """
+        from results_reader import read_results
+
+        with self._lock:
+            known = {r["path"]: r["mtime_ns"] for r in self._db.execute("SELECT path, mtime_ns FROM result_files")}
+        count = 0
+        for path in sorted(glob.glob(os.path.join(results_dir, "*.xlsx"))):
+            mtime_ns = os.stat(path).st_mtime_ns
+            if known.get(path) == mtime_ns:
+                continue
+            try:
+                with open(path, "rb") as f:
+                    metadata, events = read_results(f.read(), with_images=False)
+            except Exception as e:
+                print(f"results index: skipping {path}: {e}")
+                continue
+            self._index_parsed(path, mtime_ns, metadata, events)
+            count += 1
+            if sleep:
+                sleep(0)
+        return count
+
+    def _index_parsed(self, path, mtime_ns, metadata, events):
+        self.record_file(path, {
+            "Script Name": metadata.get("script name"),
+            "Device Serial No.": metadata.get("serial"),
+            "Operator Name": metadata.get("operatorName"),
+            "Unit Index": metadata.get("unitIndex"),
+            "Date/Time": metadata.get("timestamp"),
+            "Additional Comments": metadata.get("comments"),
+        }, mtime_ns)
+        for e in events:
+            if e.get("message type") != "test end":
+                continue
+            self.record_test(
+                path, e.get("test name"), e.get("result type"), e.get("pass"),
+                value=e.get("result") if e.get("result type") != "vector" else None,
+                result_unit=e.get("result unit"),
+                expected_range=e.get("expected range"),
+                points=len(e["x"]) if "x" in e else None,
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
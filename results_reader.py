@@ -0,0 +1,207 @@
+import re
+from ast import literal_eval
+from io import BytesIO
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.packaging.relationship import get_dependents, get_rels_path
+from openpyxl.xml.functions import fromstring
+from image_store import get_originals, get_store
+from metrics import TIMING_SHEET
+
+IMAGE_REL = "/image"
+DRAWING_REL = "/drawing"
+
+
+def read_results(raw, with_images=True):
+    """
+    Parse the bytes of a results workbook into (metadata_dict, [result_event_dicts])
+    for the frontend. The workbook is opened once, in read-only mode: pandas reads
+    the typed sheets from it and the embedded images are pulled from the same archive.
+    With with_images=False image tests are still reported, but their bytes are not
+    read or stored and their 'result' is None.
+    """
+    wb = load_workbook(filename=BytesIO(raw), read_only=True, data_only=True)
+    xl = pd.ExcelFile(wb, engine="openpyxl")
+    try:
+        df_map = xl.parse(sheet_name=None)
+        images = sheet_images(wb, with_images)
+    finally:
+        xl.close()
+    return build_events(df_map, images)
+
+
+def sheet_images(wb, load=True):
+    """
+    {sheet title: [image bytes, ...]} for a read-only workbook, in drawing order
+    (None in place of the bytes when load is False).
+    """
+    archive = wb._archive
+    names = set(archive.namelist())
+    found = {}
+    for ws in wb.worksheets:
+        rels_path = get_rels_path(ws._worksheet_path)
+        if rels_path not in names:
+            continue
+        for rel in get_dependents(archive, rels_path):
+            if not rel.Type.endswith(DRAWING_REL) or rel.target not in names:
+                continue
+            drawing = SpreadsheetDrawing.from_tree(fromstring(archive.read(rel.target)))
+            drawing_rels = get_rels_path(rel.target)
+            if drawing_rels not in names:
+                continue
+            deps = get_dependents(archive, drawing_rels)
+            for blip in drawing._blip_rels:
+                dep = deps.get(blip.embed)
+                if dep is not None and dep.Type.endswith(IMAGE_REL):
+                    found.setdefault(ws.title, []).append(archive.read(dep.target) if load else None)
+    return found
+
+
+def _expected_range(raw):
+    try:
+        rng = literal_eval(raw) if isinstance(raw, str) else raw
+        return list(rng)
+    except Exception:
+        return []
+
+
+def build_events(df_map, images):
+    """
+    Given a dict of DataFrames from an Excel results file and its embedded images,
+    return (metadata_dict, [result_event_dicts]) suitable for the frontend.
+    """
+    # 1) Metadata from the "Details" sheet
+    details = df_map.get("Details")
+    if details is None:
+        raise ValueError("Missing 'Details' sheet")
+    meta_row = details.iloc[0].to_dict()
+    metadata = {
+        'script name': meta_row.get("Script Name") or meta_row.get("script"),
+        'operatorName': meta_row.get("Operator Name") or meta_row.get("operator"),
+        'timestamp': meta_row.get("Date/Time") or meta_row.get("timestamp"),
+        'unitIndex': meta_row.get("Unit Index") or meta_row.get("unitIndex"),
+        'serial': meta_row.get("Device Serial No.") or meta_row.get("serial"),
+        'comments': meta_row.get("Additional Comments") or meta_row.get("comments"),
+    }
+    unit_index = metadata['unitIndex']
+
+    # 2) Flatten each test-sheet into a sequence of “events”, a column at a time
+    events = []
+    for sheet, df in df_map.items():
+        if sheet in ("Details", TIMING_SHEET) or df.empty:
+            continue
+        rtype = df['result type'].iloc[0].lower() if 'result type' in df.columns else None
+
+        # BOOLEAN: one row, 'result' column holds the pass/fail
+        if rtype == 'boolean':
+            results = df["result"].tolist()
+            passes = df["pass"].tolist() if "pass" in df.columns else results
+            for name, rt, res, pass_val in zip(df["test name"].tolist(), df["result type"].tolist(),
+                                               results, passes):
+                events.append({
+                    'message type': "test end",
+                    'test name': name,
+                    'unit index': unit_index,
+                    'result type': rt,
+                    'result': res,
+                    'pass': pass_val,
+                    'expected range': None,
+                })
+
+        # NUMBER: final numeric value + pass/fail
+        elif rtype == 'number':
+            # we assume columns: test name, expected range, result value, pass
+            n = len(df)
+            ranges = df["expected range"].tolist() if "expected range" in df.columns else [None] * n
+            units = df["result unit"].tolist() if "result unit" in df.columns else [""] * n
+            values = df["result value"].tolist() if "result value" in df.columns else [None] * n
+            fallback = df["result"].tolist() if "result" in df.columns else [None] * n
+            for name, rt, rng, unit, val, alt, pass_val in zip(
+                    df["test name"].tolist(), df["result type"].tolist(), ranges, units,
+                    values, fallback, df["pass"].tolist()):
+                events.append({
+                    'message type': "test end",
+                    'test name': name,
+                    'unit index': unit_index,
+                    'result type': rt,
+                    'result': val or alt,
+                    'pass': pass_val,
+                    'result unit': str(unit),
+                    'expected range': _expected_range(rng),
+                })
+
+        # VECTOR: extract x/y plus metadata columns from the sheet
+        elif "x" in df.columns and "y" in df.columns:
+            exp = df["expected range"].iloc[0] if "expected range" in df.columns else None
+            expected = _expected_range(exp)
+            raw_p = df["pass"].iloc[0] if "pass" in df.columns else None
+            p = str(raw_p)
+            # parse header's result unit into two strings
+            if "result unit" in df.columns:
+                raw_u = df["result unit"].iloc[0]
+                raw_u = re.sub("[!@#$()']", "", raw_u)
+            else:
+                raw_u = ""
+            # split on comma if present, else duplicate
+            if isinstance(raw_u, str) and "," in raw_u:
+                parts = [u.strip() for u in raw_u.split(",", 1)]
+                ru = parts if len(parts) == 2 else [parts[0], parts[0]]
+            else:
+                u = str(raw_u)
+                ru = [u, u]
+            # one "test end" carrying the x/y columns (no per-point events)
+            events.append({
+                'message type': "test end",
+                'test name': sheet,
+                'unit index': unit_index,
+                'result type': "vector",
+                'result': None,
+                'pass': p.lower(),
+                'result unit': ru,
+                'expected range': expected,
+                'x': df["x"].tolist(),
+                'y': df["y"].tolist(),
+            })
+
+        # IMAGE: embedded pictures, with pass taken from the sheet header
+        if images.get(sheet):
+            events.extend(image_events(sheet, df, images[sheet], metadata))
+
+    return metadata, events
+
+
+def image_events(sheet, df, blobs, metadata):
+    raw_p = df["pass"].iloc[0] if "pass" in df.columns else None
+    p = str(raw_p)
+    store = get_store()
+
+    # the embedded picture may be a thumbnail of a full-resolution original linked from the sheet
+    original = None
+    if len(blobs) == 1 and "original" in df.columns and isinstance(df["original"].iloc[0], str):
+        name = df["original"].iloc[0].rsplit("/", 1)[-1]
+        # workbooks written before originals had their own store link into the cache
+        for linked in (get_originals(), store):
+            if linked.path(name) is not None:
+                original = linked.url(name)
+                break
+
+    events = []
+    for data in blobs:
+        # embedded bytes go into the content-addressed store; the browser fetches them when shown
+        if original is not None:
+            url = original
+        else:
+            url = store.url(store.put(data)) if data is not None else None
+
+        # send it exactly like a 'test end' event
+        events.append({
+            "message type": "test end",
+            "test name": sheet,
+            "unit index": metadata["unitIndex"],
+            "result type": "image",
+            "result": url,
+            "pass": p.lower(),
+            "expected range": None
+        })
+    return events
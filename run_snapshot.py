@@ -0,0 +1,108 @@
+import json
+import threading
+import zlib
+
+# Most vector points a snapshot keeps per test; longer vectors are downsampled evenly
+SNAPSHOT_MAX_POINTS = 1000
+SNAPSHOT_COMPRESSION = 6
+
+
+class _TestState:
+    __slots__ = ("unit", "test", "result_type", "result_unit", "expected", "status",
+                 "result", "final", "points", "stride", "count", "last_point")
+
+    def __init__(self, unit, test, event):
+        self.unit = unit
+        self.test = test
+        self.reset(event)
+
+    def reset(self, event):
+        self.result_type = event.get("result type")
+        self.result_unit = event.get("result unit")
+        self.expected = event.get("expected range")
+        self.status = "in progress"
+        self.result = None  # latest update's result
+        self.final = None  # the test end's result
+        self.points = []  # every stride-th vector point
+        self.stride = 1
+        self.count = 0
+        self.last_point = None
+
+    def add_point(self, point, max_points):
+        if self.count % self.stride == 0:
+            self.points.append(point)
+            if len(self.points) > max_points:
+                # keep every other point we had, and take half as many from now on
+                self.points = self.points[::2]
+                self.stride *= 2
+        self.count += 1
+        self.last_point = point
+
+    def as_dict(self):
+        points = None
+        if self.count:
+            points = list(self.points)
+            if (self.count - 1) % self.stride:
+                points.append(self.last_point)  # always show the latest point
+        return {
+            "unit index": self.unit,
+            "test name": self.test,
+            "result type": self.result_type,
+            "result unit": self.result_unit,
+            "expected range": self.expected,
+            "pass": self.status,
+            "result": self.result,
+            "final result": self.final,
+            "points": points,
+            "point count": self.count,
+        }
+
+
+class RunSnapshot:
+    """
+    Compact state of one run, updated event by event, for browsers that join
+    mid-run: per unit/test the status, latest and final result, and the vector
+    points downsampled to at most max_points (every stride-th point; the stride
+    doubles whenever the limit is passed). It is fed the events the run's emitter
+    has actually sent, so a snapshot taken while the emitter is held, followed by
+    the live events after it, is the whole run with nothing missing or repeated.
+    """
+
+    def __init__(self, max_points=SNAPSHOT_MAX_POINTS):
+        self.max_points = max_points
+        self._tests: dict[tuple, _TestState] = {}
+        self._lock = threading.Lock()
+
+    def apply_all(self, events):
+        with self._lock:
+            for event in events:
+                self._apply(event)
+
+    def _apply(self, event):
+        key = (event.get("unit index"), event.get("test name"))
+        state = self._tests.get(key)
+        if state is None:
+            state = self._tests[key] = _TestState(key[0], key[1], event)
+        mtype = event.get("message type")
+        if mtype == "new test":
+            state.reset(event)
+        elif mtype == "update":
+            point = event.get("result")
+            if (state.result_type or "").lower() == "vector" \
+                    and isinstance(point, (list, tuple)) and len(point) >= 2:
+                state.add_point(list(point[:2]), self.max_points)
+            else:
+                state.result = point
+            state.status = event.get("pass")
+        elif mtype == "test end":
+            state.status = event.get("pass")
+            state.final = event.get("result")
+
+    def tests(self):
+        with self._lock:
+            return [s.as_dict() for s in self._tests.values()]
+
+    def compressed(self, **fields):
+        """The snapshot (plus any extra top-level fields) as zlib-compressed JSON."""
+        payload = dict(fields, tests=self.tests())
+        return zlib.compress(json.dumps(payload, default=str).encode("utf-8"), SNAPSHOT_COMPRESSION)
@@ -0,0 +1,177 @@
+import ast
+import json
+import os
+import threading
+import time
+
+CATALOG_PATH = os.path.join("cache", "script_catalog.json")
+# How often the watcher rescans the scripts directory (seconds)
+WATCH_INTERVAL = 2.0
+# Bumped whenever parse_script changes, so entries saved by an older version are re-parsed
+CATALOG_VERSION = 2
+
+
+class _NotStatic(Exception):
+    pass
+
+
+def _literal_tree(node):
+    """Stripped test tree from an AVAILABLE_TESTS dict literal (same shape as strip_tree)."""
+    if not isinstance(node, ast.Dict):
+        raise _NotStatic()
+    cleaned = {}
+    for k, v in zip(node.keys, node.values):
+        if not (isinstance(k, ast.Constant) and isinstance(k.value, str)):
+            raise _NotStatic()
+        if k.value in ('funcs', 'exec_order'):
+            continue
+        # a subtree held in a variable, built by a call, ... is only known by importing the script
+        cleaned[k.value] = _literal_tree(v)
+    return cleaned
+
+
+def _root_name(node):
+    """The variable an expression like NAME['a'].b is rooted at, if any."""
+    while isinstance(node, (ast.Subscript, ast.Attribute)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _changed_elsewhere(tree, name, assigned):
+    """
+    Whether the module rebinds or modifies `name` anywhere but its top-level
+    assignments (the Name nodes in `assigned`): augmented or nested assignment,
+    item/attribute assignment or deletion, or any method call on it (.update, ...).
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == name:
+            if not isinstance(node.ctx, ast.Load) and node not in assigned:
+                return True
+        elif isinstance(node, (ast.Subscript, ast.Attribute)) and _root_name(node) == name:
+            if isinstance(node, ast.Attribute) or not isinstance(node.ctx, ast.Load):
+                return True
+    return False
+
+
+def parse_script(path):
+    """
+    Read AVAILABLE_TESTS and MULTI_UNIT_SUPPORTED_NUMBER from a script's source
+    without executing it. "static" is False when either one is not a plain
+    literal, in which case callers have to import the script instead.
+    """
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    tests_node = None
+    units_node = None
+    assigned = []
+    for stmt in tree.body:
+        if isinstance(stmt, ast.Assign):
+            targets, value = stmt.targets, stmt.value
+        elif isinstance(stmt, ast.AnnAssign) and stmt.value is not None:
+            targets, value = [stmt.target], stmt.value
+        else:
+            continue
+        for t in targets:
+            if isinstance(t, ast.Name) and t.id == "AVAILABLE_TESTS":
+                tests_node = value
+                assigned.append(t)
+            elif isinstance(t, ast.Name) and t.id == "MULTI_UNIT_SUPPORTED_NUMBER":
+                units_node = value
+                assigned.append(t)
+
+    entry = {"tests": {}, "multiUnitSupportedNumber": 1, "static": True}
+    try:
+        if any(_changed_elsewhere(tree, n, assigned) for n in ("AVAILABLE_TESTS", "MULTI_UNIT_SUPPORTED_NUMBER")):
+            raise _NotStatic()
+        if tests_node is not None:
+            entry["tests"] = _literal_tree(tests_node)
+        if units_node is not None:
+            if not (isinstance(units_node, ast.Constant) and isinstance(units_node.value, int)):
+                raise _NotStatic()
+            entry["multiUnitSupportedNumber"] = units_node.value
+    except _NotStatic:
+        entry["static"] = False
+    return entry
+
+
+class ScriptCatalog:
+    """
+    Index of every script in the scripts directory: its test tree and max unit count,
+    built from the source (no import) and persisted to CATALOG_PATH.
+    refresh() only re-parses scripts whose mtime/size changed; watch() calls it periodically.
+    """
+
+    def __init__(self, scripts_dir, path=CATALOG_PATH):
+        self.scripts_dir = scripts_dir
+        self.path = path
+        self._entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def names(self):
+        return sorted(self._entries)
+
+    def get(self, script_name):
+        """Catalog entry for a script, picking up a file the watcher hasn't seen yet."""
+        entry = self._entries.get(script_name)
+        if entry is None and os.path.exists(os.path.join(self.scripts_dir, f"{script_name}.py")):
+            self.refresh()
+            entry = self._entries.get(script_name)
+        return entry
+
+    def refresh(self):
+        """Bring the catalog in line with the directory; returns True if anything changed."""
+        changed = False
+        seen = set()
+        try:
+            files = [e for e in os.scandir(self.scripts_dir) if e.is_file() and e.name.endswith(".py")]
+        except FileNotFoundError:
+            files = []
+
+        with self._lock:
+            for e in files:
+                name = e.name[:-3]
+                seen.add(name)
+                st = e.stat()
+                old = self._entries.get(name)
+                if old and (old.get("version"), old["mtime_ns"], old["size"]) == \
+                        (CATALOG_VERSION, st.st_mtime_ns, st.st_size):
+                    continue
+                try:
+                    entry = parse_script(e.path)
+                except (SyntaxError, ValueError, OSError):
+                    entry = {"tests": {}, "multiUnitSupportedNumber": 1, "static": False}
+                entry["version"] = CATALOG_VERSION
+                entry["mtime_ns"] = st.st_mtime_ns
+                entry["size"] = st.st_size
+                self._entries[name] = entry
+                changed = True
+
+            for name in set(self._entries) - seen:
+                del self._entries[name]
+                changed = True
+
+            if changed:
+                self._save()
+        return changed
+
+    def watch(self, interval=WATCH_INTERVAL, sleep=time.sleep):
+        """Rescan forever (run as a background task)."""
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print("script catalog refresh failed:", e)
+            sleep(interval)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp, self.path)
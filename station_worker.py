@@ -0,0 +1,253 @@
+"""
+Station worker: executes test runs for the fixtures attached to this machine and
+streams everything they report to the central server (app.py), which saves the
+results and shows the run in the browser like a local one.
+
+    python station_worker.py --server 192.168.1.10:5001 --worker-id station-3 \
+        --script testing_script_2 --tests Group_A Group_A/Test_1 --units 1 2 --serials 1234 5678
+"""
+import argparse
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from result_store import ResultStore
+from stations import STATION_PORT, read_messages, send_message
+from test_manager import ScriptRegistry, TestRun
+
+# Messages not yet acknowledged by the server; reporting blocks beyond this many
+OUTBOX_LIMIT = 20000
+# Delay between reconnect attempts, doubling up to the maximum (seconds)
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 10.0
+CONNECT_TIMEOUT = 5.0
+
+
+class Link:
+    """
+    The worker's connection to the server. Every message gets a sequence number
+    and stays in the outbox until the server acknowledges it; after a disconnect
+    the link reconnects, learns the last sequence number the server handled and
+    sends the rest again, so nothing is lost or handled twice.
+    """
+
+    def __init__(self, address, worker_id, on_stop=None, max_unacked=OUTBOX_LIMIT):
+        self.address = address
+        self.worker_id = worker_id
+        self.session = uuid.uuid4().hex  # tells the server a restarted worker from a reconnecting one
+        self.on_stop = on_stop
+        self.max_unacked = max_unacked
+        self._seq = 0
+        self._outbox = deque()
+        self._sock = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._connect_loop, daemon=True)
+        self._thread.start()
+
+    def send(self, message):
+        """Queue a message (blocking while the outbox is full) and send it if connected."""
+        with self._cond:
+            while len(self._outbox) >= self.max_unacked and not self._closed:
+                self._cond.wait()
+            self._seq += 1
+            message = dict(message, seq=self._seq)
+            self._outbox.append(message)
+            if self._sock is not None:
+                try:
+                    send_message(self._sock, message)
+                except OSError:
+                    pass  # resent after reconnecting
+
+    def wait_acked(self, timeout=None):
+        """Block until the server has acknowledged everything sent; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._outbox:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            sock, self._sock = self._sock, None
+            self._cond.notify_all()
+        if sock is not None:
+            sock.close()
+
+    def _ack(self, seq):
+        # called with self._cond held
+        while self._outbox and self._outbox[0]["seq"] <= seq:
+            self._outbox.popleft()
+        self._cond.notify_all()
+
+    def _connect_loop(self):
+        delay = RECONNECT_MIN
+        while not self._closed:
+            sock = None
+            try:
+                sock = socket.create_connection(self.address, timeout=CONNECT_TIMEOUT)
+                sock.settimeout(None)
+                send_message(sock, {"type": "hello", "worker": self.worker_id, "session": self.session})
+                messages = read_messages(sock)
+                welcome = next(messages, None)
+                if not welcome or welcome.get("type") != "welcome":
+                    raise ConnectionError("no welcome from the server")
+                with self._cond:
+                    if self._closed:
+                        break
+                    self._ack(welcome.get("lastSeq", 0))
+                    for message in self._outbox:
+                        send_message(sock, message)
+                    self._sock = sock
+                print(f"Connected to {self.address[0]}:{self.address[1]}")
+                delay = RECONNECT_MIN
+                for msg in messages:
+                    if msg.get("type") == "ack":
+                        with self._cond:
+                            self._ack(msg.get("seq", 0))
+                    elif msg.get("type") == "stop" and self.on_stop:
+                        self.on_stop(msg.get("key"))
+                if not self._closed:
+                    print("Server closed the connection")
+            except (OSError, ValueError) as e:
+                if not self._closed:
+                    print(f"Server connection error: {e}")
+            finally:
+                with self._cond:
+                    if self._sock is sock:
+                        self._sock = None
+                if sock is not None:
+                    sock.close()
+            if not self._closed:
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX)
+
+
+class _NullSocketIO:
+    def emit(self, *args, **kwargs):
+        pass
+
+    def start_background_task(self, target, *args, **kwargs):
+        threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True).start()
+
+
+class StationManager:
+    """The parts of TestManager a TestRun needs, for runs whose outputs live on the server."""
+
+    def __init__(self, link):
+        self.link = link
+        self.socketio = _NullSocketIO()
+        self.scripts = ScriptRegistry()
+        self.results = ResultStore()
+        self.index = None
+        self.runs = {}
+
+    def _claim_path(self, path):
+        return path
+
+    def _run_finished(self, run):
+        self.link.send({"type": "run_end", "key": run.run_id, "state": run.state,
+                        "error": run.error, "timings": run.timings.rows()})
+
+
+class _RunErrors:
+    """Stands in for the run's emitter: the only thing a worker-side run sends itself is run_error."""
+
+    def __init__(self, run):
+        self.run = run
+
+    def emit(self, result):
+        pass
+
+    def send(self, event, data):
+        if event == "run_error":
+            self.run.error = data.get("error")
+
+    def flush(self):
+        pass
+
+
+class StationRun(TestRun):
+    """
+    A TestRun executed here whose reports, progress and end are streamed to the
+    server instead of being emitted and saved locally.
+    """
+
+    def __init__(self, manager, *args):
+        super().__init__(manager, *args)
+        self.link = manager.link
+        self.emitter = _RunErrors(self)
+        self.error = None
+
+    def _open_outputs(self):
+        self.link.send({"type": "run_start", "key": self.run_id, "script": self.script_name,
+                        "tests": self.selected_tests, "details": self.details, "units": self.selected_units})
+
+    def report(self, result):
+        self.link.send({"type": "event", "key": self.run_id, "event": result})
+
+    def _step_done(self, test, unit):
+        with self._progress_lock:
+            self.steps_done += 1
+            completed = self.steps_done
+        self.link.send({"type": "progress", "key": self.run_id, "completed": completed, "total": self.total_steps})
+
+    def _write_checkpoint(self):
+        pass  # the server keeps the results; a worker's run can't be resumed from its checkpoint
+
+    def _complete(self):
+        self.running = False
+
+    def _close_run(self):
+        pass
+
+
+def _address(value):
+    host, _, port = value.rpartition(":")
+    if not host:
+        return value, STATION_PORT
+    return host, int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run tests on this station and stream them to the server.")
+    parser.add_argument("--server", type=_address, default=("127.0.0.1", STATION_PORT), help="host[:port]")
+    parser.add_argument("--worker-id", default=socket.gethostname())
+    parser.add_argument("--script", required=True)
+    parser.add_argument("--tests", nargs="+", required=True, help="selected test paths, as the UI sends them")
+    parser.add_argument("--units", type=int, nargs="+", default=[1])
+    parser.add_argument("--serials", nargs="*", default=[])
+    parser.add_argument("--comments", nargs="*", default=[])
+    parser.add_argument("--operator", default="")
+    parser.add_argument("--ack-timeout", type=float, default=None,
+                        help="give up waiting for the server to acknowledge everything after this many seconds")
+    args = parser.parse_args(argv)
+
+    runs = {}
+    link = Link(args.server, args.worker_id, on_stop=lambda key: runs[key].stop() if key in runs else None)
+    manager = StationManager(link)
+    details = {"serials": args.serials, "comments": args.comments, "operatorName": args.operator}
+    run = StationRun(manager, args.script, args.tests, details, args.units)
+    runs[run.run_id] = run
+    signal.signal(signal.SIGINT, lambda *_: run.stop())
+
+    print(f"Run {run.run_id} started")
+    run.run()
+    print(f"Run {run.run_id} {run.state}; waiting for the server to receive everything")
+    delivered = link.wait_acked(args.ack_timeout)
+    link.close()
+    if not delivered:
+        print("Gave up before the server acknowledged every message")
+        return 2
+    return 0 if run.state == "complete" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import json
+import socket
+import threading
+
+# TCP port the server listens on for station workers (station_worker.py)
+STATION_PORT = 5001
+# A disconnected worker's runs are marked failed if it hasn't reconnected within this time (seconds)
+WORKER_RESUME_TIMEOUT = 60
+# Streamed events are acknowledged at least every this many messages
+ACK_EVERY = 50
+
+
+def send_message(sock, message):
+    """Write one protocol message: a JSON object on its own line."""
+    sock.sendall((json.dumps(message, default=str) + "\n").encode("utf-8"))
+
+
+def read_messages(sock):
+    """Yield the JSON messages arriving on a socket until it is closed."""
+    with sock.makefile("r", encoding="utf-8", newline="\n") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class _Station:
+    """What the aggregator knows about one worker, kept across its reconnects."""
+
+    def __init__(self, worker_id, session):
+        self.worker_id = worker_id
+        self.session = session
+        self.last_seq = 0  # last message handled; anything resent up to here is a duplicate
+        self.conn = None
+        self.runs = {}  # the worker's run id -> TestRun here
+        self.pending_stops = set()
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+
+
+class StationServer:
+    """
+    Aggregates runs executed by station workers. Each worker streams numbered
+    messages over one TCP connection (run_start, event, progress, run_end); they
+    are replayed into a TestRun created here, which persists the results and
+    emits to browsers exactly like a local run. Messages are acknowledged, and a
+    worker that reconnects resends whatever wasn't, so duplicates are skipped by
+    sequence number. Stopping such a run from the UI is forwarded to its worker.
+    """
+
+    def __init__(self, manager, host="0.0.0.0", port=STATION_PORT, resume_timeout=WORKER_RESUME_TIMEOUT):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.resume_timeout = resume_timeout
+        self.stations: dict[str, _Station] = {}
+        self._lock = threading.Lock()
+
+    def serve(self):
+        """Accept worker connections forever (run it as a background task)."""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind((self.host, self.port))
+        except OSError as e:
+            print(f"Station server could not listen on port {self.port}: {e}")
+            listener.close()
+            return
+        listener.listen()
+        print(f"Listening for station workers on port {self.port}")
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        station = None
+        try:
+            messages = read_messages(conn)
+            hello = next(messages, None)
+            if not hello or hello.get("type") != "hello":
+                return
+            station = self._attach(hello.get("worker"), hello.get("session"), conn)
+            unacked = 0
+            for msg in messages:
+                seq = msg.get("seq", 0)
+                with station.lock:
+                    if seq <= station.last_seq:
+                        continue  # resent after a reconnect, already handled
+                    self._dispatch(station, msg)
+                    station.last_seq = seq
+                unacked += 1
+                if msg.get("type") != "event" or unacked >= ACK_EVERY:
+                    self._send(station, {"type": "ack", "seq": seq})
+                    unacked = 0
+        except (OSError, ValueError) as e:
+            print(f"Station {station.worker_id if station else '?'} connection error: {e}")
+        finally:
+            conn.close()
+            if station is not None:
+                self._detach(station, conn)
+
+    def _attach(self, worker_id, session, conn):
+        with self._lock:
+            station = self.stations.get(worker_id)
+            if station is None or station.session != session:
+                # a new worker process starts counting again; its old runs can't be resumed
+                if station is not None:
+                    self._fail_runs(station, f"Station worker '{worker_id}' restarted")
+                station = self.stations[worker_id] = _Station(worker_id, session)
+            old, station.conn = station.conn, conn
+        if old is not None:
+            old.close()
+        with station.lock:
+            self._send(station, {"type": "welcome", "lastSeq": station.last_seq})
+            for key in station.pending_stops:
+                self._send(station, {"type": "stop", "key": key})
+        print(f"Station worker '{worker_id}' connected (resuming after #{station.last_seq})")
+        return station
+
+    def _detach(self, station, conn):
+        with self._lock:
+            if station.conn is not conn:
+                return  # already replaced by a newer connection
+            station.conn = None
+        if station.runs:
+            print(f"Station worker '{station.worker_id}' disconnected; waiting {self.resume_timeout}s for it to resume")
+            timer = threading.Timer(self.resume_timeout, self._resume_expired, args=(station,))
+            timer.daemon = True
+            timer.start()
+
+    def _resume_expired(self, station):
+        with self._lock:
+            if station.conn is not None:
+                return
+        self._fail_runs(station, f"Station worker '{station.worker_id}' disconnected")
+
+    def _fail_runs(self, station, error):
+        with station.lock:
+            runs = list(station.runs.values())
+            station.runs.clear()
+            station.pending_stops.clear()
+        for run in runs:
+            run.finish_remote("failed", error)
+
+    def _send(self, station, message):
+        conn = station.conn
+        if conn is None:
+            return False
+        try:
+            with station.send_lock:
+                send_message(conn, message)
+            return True
+        except OSError:
+            return False
+
+    def _dispatch(self, station, msg):
+        kind = msg.get("type")
+        key = msg.get("key")
+        if kind == "run_start":
+            run = self.manager.create_run(msg.get("script"), msg.get("tests", []),
+                                          msg.get("details", {}), msg.get("units", []))
+            run.station = station.worker_id
+            run.on_stop = lambda r: self._stop(station, key)
+            run.attach_remote()
+            station.runs[key] = run
+            self.manager.socketio.emit("run_started", run.summary())
+            return
+        run = station.runs.get(key)
+        if run is None:
+            return  # a run this server no longer knows (e.g. already failed)
+        if kind == "event":
+            run.report(msg["event"])
+        elif kind == "progress":
+            run.remote_progress(msg.get("completed", 0), msg.get("total", 0))
+        elif kind == "run_end":
+            del station.runs[key]
+            station.pending_stops.discard(key)
+            run.timings.extend(msg.get("timings", []))
+            run.finish_remote(msg.get("state", "complete"), msg.get("error"))
+
+    def _stop(self, station, key):
+        with station.lock:
+            if key not in station.runs:
+                return
+            station.pending_stops.add(key)  # sent again if the worker reconnects
+        self._send(station, {"type": "stop", "key": key})
@@ -1,550 +1,792 @@
 from _datetime import datetime
-import re
+import glob
+import hashlib
 import importlib.util
+import itertools
 import json
 import os
-import pandas as pd
-from io import BytesIO
-from PIL import Image
-from collections import defaultdict
-from openpyxl.drawing.image import Image as XLImage
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from result_writer import SheetData, excel_sheet_name, make_writer
+from event_log import LOG_DIR, EventLog, export_xlsx
+from result_store import ResultStore
+from results_reader import read_results
+from results_index import ResultsIndex
+from emitter import EventEmitter
+from run_snapshot import RunSnapshot
+from test_plan import compile_plan, flatten_tests, strip_tree
+from cooperative import drive, is_cooperative, run_blocking, run_interleaved
+from metrics import PHASE_SECONDS, SAVE_SECONDS, TEST_FUNCTION_SECONDS, TIMING_SHEET, RunTimings
 
 SCRIPTS_DIR = "test_scripts"
-
-class TestManager:
-    def __init__(self, socketio):
-        self.socketio = socketio
+# Runs executed at the same time (e.g. one per station); further runs wait for a free slot
+MAX_CONCURRENT_RUNS = 4
+# Finished runs kept around, with their in-memory results, for /progress and exports
+KEEP_FINISHED_RUNS = 8
+# Written into each run's log directory as its steps are saved, for resume()
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def checkpoint_path(run_id):
+    return os.path.join(LOG_DIR, run_id, CHECKPOINT_FILE)
+
+
+def read_checkpoint(run_id):
+    """A run's last checkpoint, or None if it has none."""
+    if not run_id or os.path.basename(run_id) != run_id:
+        return None
+    try:
+        with open(checkpoint_path(run_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class LoadedScript:
+    """A test script module plus everything derived from it."""
+
+    def __init__(self, name, module, mtime_ns, size, digest):
+        self.name = name
+        self.module = module
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.digest = digest
+        self.raw = getattr(module, "AVAILABLE_TESTS", {})
+        self.tree = strip_tree(self.raw)
+        self.tests = flatten_tests(self.raw)[0]
+        self.max_units = getattr(module, "MULTI_UNIT_SUPPORTED_NUMBER", 1)
+
+
+class ScriptRegistry:
+    """
+    Loads each test_scripts/*.py module once and caches it.
+    A script is reloaded when its mtime/size changes and its content hash differs.
+    """
+
+    def __init__(self, scripts_dir=SCRIPTS_DIR):
+        self.scripts_dir = scripts_dir
+        self._cache: dict[str, LoadedScript] = {}
+        self._lock = threading.Lock()
+
+    def path(self, script_name):
+        return os.path.join(self.scripts_dir, f"{script_name}.py")
+
+    def load(self, script_name) -> LoadedScript | None:
+        """Return the cached script, (re)loading it if the file changed; None if it doesn't exist."""
+        script_path = self.path(script_name)
+        try:
+            st = os.stat(script_path)
+        except FileNotFoundError:
+            with self._lock:
+                self._cache.pop(script_name, None)
+            return None
+
+        with self._lock:
+            cached = self._cache.get(script_name)
+            if cached and (cached.mtime_ns, cached.size) == (st.st_mtime_ns, st.st_size):
+                return cached
+
+            with open(script_path, "rb") as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            if cached and cached.digest == digest:
+                # touched but not edited
+                cached.mtime_ns, cached.size = st.st_mtime_ns, st.st_size
+                return cached
+
+            spec = importlib.util.spec_from_file_location(script_name, script_path)
+            mod = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(mod)
+            script = LoadedScript(script_name, mod, st.st_mtime_ns, st.st_size, digest)
+            self._cache[script_name] = script
+            return script
+
+    def invalidate(self, script_name=None):
+        with self._lock:
+            if script_name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(script_name, None)
+
+
+class TestRun:
+    """
+    Everything about one run: its selection, plan, progress, result files, event log
+    and emitter. Its Socket.IO events go to the room named after run_id.
+    state: "queued" -> "running" -> "complete" | "stopped" | "failed".
+    Every step whose results are saved is recorded in a checkpoint; a run created
+    from one (checkpoint=...) keeps its id and result files and skips those steps.
+    """
+
+    def __init__(self, manager, script_name, selected_tests, details, selected_units, checkpoint=None):
+        self.manager = manager
+        self.results = manager.results
+        self.index = manager.index
+        self.script_name = script_name
+        self.selected_tests = selected_tests
+        self.details = details
+        self.selected_units = selected_units
+        if checkpoint is None:
+            self.run_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            self.run_id = f"{script_name}_{self.run_timestamp}_{uuid.uuid4().hex[:6]}"
+            checkpoint = {}
+        else:
+            self.run_timestamp = checkpoint["runTimestamp"]
+            self.run_id = checkpoint["runId"]
+        # (unit, test) steps whose results are on disk; unit None = once-only tests
+        self.completed = {(u, t) for u, t in checkpoint.get("done", [])}
+        self._resume_paths = {int(u): p for u, p in checkpoint.get("unitPaths", {}).items()}
+        self._script_digest = checkpoint.get("scriptDigest")
+        self._resume_timings = checkpoint.get("timings", [])  # the Timing rows recorded before the resume
+        self._checkpoint_lock = threading.Lock()
+        # what browsers that join mid-run get first: built from the events the emitter sent
+        self.snapshot = RunSnapshot()
+        self.emitter = EventEmitter(manager.socketio, room=self.run_id, on_sent=self.snapshot.apply_all,
+                                    run_id=self.run_id)
+        self.state = "queued"
         self.running = False
-        self.test_data = []
-        self.details = {}
-        self.script_name = ""
-        self.selected_units = []
-        self.run_timestamp = None
-
-    def get_tests(self, script_name):
-        script_path = os.path.join(SCRIPTS_DIR, f"{script_name}.py")
-        if not os.path.exists(script_path):
-            return {}
-        spec = importlib.util.spec_from_file_location(script_name, script_path)
-        mod = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(mod)
-        raw = getattr(mod, "AVAILABLE_TESTS", {})
-        # Strip functions, leave only hierarchy
-        def strip(tree):
-            cleaned = {}
-            for k, v in tree.items():
-                # drop our execution‐order metadata (and the funcs list)
-                if k in ('funcs', 'exec_order'):
-                    continue
-                # only recurse into real dicts
-                if isinstance(v, dict):
-                    cleaned[k] = strip(v)
-                else:
-                    # leaf‐node guard: we expect subtests to be dicts
-                    cleaned[k] = {}
-            return cleaned
-        return strip(raw)
-
-    def get_max_unit_support(self, script_name):
-        script_path = os.path.join(SCRIPTS_DIR, f"{script_name}.py")
-        if not os.path.exists(script_path):
-            return {}
-        spec = importlib.util.spec_from_file_location(script_name, script_path)
-        mod = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(mod)
-        max_units = getattr(mod, "MULTI_UNIT_SUPPORTED_NUMBER", 1)
-        return max_units
+        self.writer = make_writer()
+        self._unit_paths = {}
+        self.event_log = None
+        self.plan = None
+        self.steps_done = 0
+        self.total_steps = 0
+        self.run_started = None
+        self.timings = RunTimings()
+        self._progress_lock = threading.Lock()
+        self.station = None  # id of the station worker executing the run, if not run here
+        self.on_stop = None  # called by stop(), e.g. to tell that station
+
+    def run(self):
+        """Execute the run (once); the final state says how it ended."""
+        if self.state != "queued":
+            return
+        self.state = "running"
+        try:
+            completed = self._run_tests()
+            self.state = "complete" if completed else "stopped"
+        except Exception as e:
+            self.state = "failed"
+            print(f"Run {self.run_id} failed: {e}")
+            self.emitter.send("run_error", {"runId": self.run_id, "error": str(e)})
+            self._close_run()
+        finally:
+            self.running = False
+            self._write_checkpoint()
+            self.manager._run_finished(self)
 
-    def run_tests(self, script_name, selected_tests, details, selected_units):
+    def _run_tests(self):
         """Runs selected tests from the chosen script in the proper exec_order for multiple units."""
+        script_name = self.script_name
+        selected_tests = self.selected_tests
+        selected_units = self.selected_units
         self.running = True
-        self.test_data = []
-        self.details = details
-        self.script_name = script_name
-        self.selected_units = selected_units
-
-        self.run_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        os.makedirs("results", exist_ok=True)
-
-        # Pre-create a file per enabled unit with a Details sheet (if missing)
-        serials = self.details.get("serials", [])
-        comments = self.details.get("comments", [])
-        op = (self.details.get("operatorName") or "").strip() or "Tester"
-
-        for unit_idx in sorted(self.selected_units):
-            # map unit_idx → index in details arrays
-            serial = ""
-            comment = ""
-            if unit_idx in self.selected_units:
-                di = self.selected_units.index(unit_idx)
-                if di < len(serials):
-                    serial = (str(serials[di]).strip() or "88888888")
-                else:
-                    serial = "88888888"
-                if di < len(comments):
-                    comment = (comments[di] or "No comment")
-                else:
-                    comment = "No comment"
-            else:
-                serial = "88888888"
-                comment = "No comment"
-
-            fn = f"{self.script_name}_{serial}_{self.run_timestamp}_{op}_unit{unit_idx}.xlsx"
-            out_path = os.path.join("results", fn)
-            if not os.path.exists(out_path):
-                with pd.ExcelWriter(out_path, engine="openpyxl", mode="w") as writer:
-                    info = {
-                        "Script Name": self.script_name,
-                        "Device Serial No.": serial,
-                        "Operator Name": op or "Tester",
-                        "Date/Time": datetime.now().isoformat(sep=" "),
-                        "Additional Comments": comment or "No comment",
-                        "Unit Index": unit_idx,
-                    }
-                    pd.DataFrame([info]).to_excel(writer, sheet_name="Details", index=False)
-
-        # 1) Dynamically load the test script module
-        script_path = os.path.join(SCRIPTS_DIR, f"{script_name}.py")
-        if not os.path.exists(script_path):
-            self.running = False
-            return
-        spec = importlib.util.spec_from_file_location(script_name, script_path)
-        mod = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(mod)
-        raw = getattr(mod, "AVAILABLE_TESTS", {})
-
-        # 2) Flatten the entire raw tree into ordered_tests_full, funcs_map_full, exec_order_full
-        ordered_tests_full = []
-        funcs_map_full = {}
-        exec_order_full = {}
-
-        def extract(tree, parent=""):
-            for name, subtree in tree.items():
-                if name in ("funcs", "exec_order"):
-                    continue
-                full = f"{parent}/{name}" if parent else name
-                ordered_tests_full.append(full)
-                funcs_map_full[full] = subtree.get("funcs", [])
-                exec_order_full[full] = subtree.get("exec_order", 0)
-                extract(subtree, full)
-
-        extract(raw)
-
-        # 3) Filter down to only those tests the user actually selected
-        ordered_tests = [t for t in ordered_tests_full if t in selected_tests]
-
-        # 4) Build our pruned maps for only the selected tests
-        funcs_map = {t: funcs_map_full[t] for t in ordered_tests}
-        exec_order_map = {t: exec_order_full[t] for t in ordered_tests}
-
-        # 5) Initialize per-test/per-unit tracker
-        # 5) Only track the *enabled* units
+        self._open_outputs()
+
+        # 1) Load the test script module (cached until the file changes)
+        script = self.manager.scripts.load(script_name)
+        if script is None:
+            raise ValueError(f"Unknown script '{script_name}'")
+        mod = script.module
+        raw = script.raw
+        if self._script_digest and self._script_digest != script.digest:
+            print(f"Run {self.run_id}: {script_name} changed since the run was checkpointed")
+        self._script_digest = script.digest
+        self._write_checkpoint()
+
+        # 2) Compile the selection into an explicit plan once; scripts can opt in to
+        #    running per-unit tests on all units at the same time
         unit_numbers = sorted(selected_units)
-        num_units = len(unit_numbers)
-        tracker = {t: [False] * num_units for t in ordered_tests}
-        # 6) Build executed_once only for tests with exec_order == -1
-        executed_once = {t: False for t, o in exec_order_map.items() if o == -1}
-
-        # 7) Helper to emit & record each callback
-        def report_callback(result):
-            self.socketio.emit("test_update", result)
-            self.test_data.append(result)
-            if result.get("message type") == "test end":
-                self.save_results(
-                    unit_idx=result.get("unit index"),
-                    test_name=result.get("test name")
-                )
-
-        # 8) Determine max positive exec_order
-        max_exec = max((o for o in exec_order_map.values() if o > 0), default=0)
-
-        # 9) Main multi-unit/exec_order loop
-        unit_idx = 0  # 0-based index of unit under test
-        exec_loop = 1  # current exec_order we’re processing
-
-        while True:
-            # walk entire test list in tree order
-            for idx, t in enumerate(ordered_tests):
+        parallel = bool(getattr(mod, "PARALLEL_UNITS", False)) and len(unit_numbers) > 1
+        plan = compile_plan(raw, selected_tests, unit_numbers, parallel)
+        self.plan = plan
+        self.steps_done = len(self.completed)
+        self.total_steps = plan.total_steps
+        self.run_started = time.monotonic()
+        self.timings = RunTimings(self._resume_timings)
+
+        # 3) Every callback is emitted & recorded by report()
+        report_callback = self.report
+
+        # A step is a generator of the waits its test functions ask for: plain functions
+        # just run (and yield nothing), generator/async ones pause at each wait()
+        def step(t, unit):
+            for fn in plan.funcs_map[t]:
+                start = time.monotonic()
+                yield from drive(fn(report_callback, t, unit_numbers, unit), report_callback)
+                elapsed = time.monotonic() - start
+                TEST_FUNCTION_SECONDS.observe(elapsed, t, fn.__name__, unit)
+                self.timings.add("test", f"{t} ({fn.__name__})", unit, plan.exec_order_map.get(t), start, elapsed)
+            self._step_done(t, unit)
+
+        def lane(unit, tests):
+            for t in tests:
                 if not self.running:
                     return
+                if (unit, t) in self.completed:
+                    continue  # done before the run was resumed
+                yield from step(t, unit)
+
+        def run_lane(unit, tests):
+            run_blocking(lane(unit, tests))
+
+        def cooperative_phase(phase):
+            return any(is_cooperative(fn) for tests in phase.lanes.values() for t in tests
+                       for fn in plan.funcs_map[t])
+
+        # 4) Execute the plan phase by phase
+        lanes = min(getattr(mod, "MAX_PARALLEL_UNITS", len(unit_numbers)) or len(unit_numbers),
+                    len(unit_numbers)) if parallel else 1
+        with ThreadPoolExecutor(max_workers=lanes) as pool:
+            for phase in plan.phases:
+                if not self.running:
+                    self._close_run()
+                    return False
+                phase_start = time.monotonic()
+                if phase.kind == "once":
+                    # once-only test: runs a single time for all units
+                    if (None, phase.test) not in self.completed:
+                        run_blocking(step(phase.test, None))
+                elif cooperative_phase(phase):
+                    # lanes take turns on this thread, so one unit's waits let the others run
+                    run_interleaved([lane(u, tests) for u, tests in phase.lanes.items()],
+                                    should_run=lambda: self.running)
+                elif parallel:
+                    # one lane per unit; the phase ends (barrier) when every lane is done
+                    futures = [pool.submit(run_lane, u, tests) for u, tests in phase.lanes.items()]
+                    for f in futures:
+                        f.result()
+                else:
+                    for u, tests in phase.lanes.items():
+                        run_lane(u, tests)
+                elapsed = time.monotonic() - phase_start
+                PHASE_SECONDS.observe(elapsed, phase.kind, phase.exec_order)
+                self.timings.add("phase", phase.test if phase.kind == "once" else f"exec_order {phase.exec_order}",
+                                 None, phase.exec_order, phase_start, elapsed)
+        if not self.running:
+            self._close_run()
+            return False
+
+        # 5) All done ⇒ notify frontend and save
+        self._complete()
+        return True
+
+    def _open_outputs(self):
+        """Create the run's event log and open a result workbook per enabled unit."""
+        os.makedirs("results", exist_ok=True)
+        self.event_log = EventLog(self.run_id)
 
-                order = exec_order_map[t]
-
-                if order == -1:
-                    # once-only test: only when all prior selected tests done on every unit
-                    if not executed_once[t]:
-                        prev_done = True
-                        for prev in ordered_tests[:idx]:
-                            prev_order = exec_order_map[prev]
-                            if prev_order == -1:
-                                if not executed_once[prev]:
-                                    prev_done = False
-                                    break
-                            else:
-                                if not all(tracker[prev]):
-                                    prev_done = False
-                                    break
-                        if prev_done:
-                            for fn in funcs_map[t]:
-                                fn(report_callback, t, unit_numbers, None)
-                            executed_once[t] = True
-
-                elif order == exec_loop:
-                    # per‐unit test on each selected unit
-                    if not tracker[t][unit_idx]:
-                        current_unit = unit_numbers[unit_idx]
-                        for fn in funcs_map[t]:
-                            fn(report_callback, t, unit_numbers, current_unit)
-                        tracker[t][unit_idx] = True
-
-                # skip any test whose order < exec_loop or > exec_loop
-
-            # 10) Check for overall completion
-            if exec_loop > max_exec and all(executed_once.values()):
-                break
-
-            # 11) Advance unit or exec_loop
-            if unit_idx < num_units - 1:
-                unit_idx += 1
-            else:
-                unit_idx = 0
-                exec_loop += 1
-
-        # 12) All done ⇒ notify frontend and save
-        self.socketio.emit("test_complete", {"message": "Test execution complete."})
+        # Pre-create a workbook per enabled unit with a Details sheet (if missing)
+        self.writer = make_writer(on_saved=self._on_results_saved, on_error=self._on_results_error,
+                                  on_durable=self._on_steps_saved)
+        for unit_idx in sorted(self.selected_units):
+            self._open_unit_book(unit_idx)
+
+    def report(self, result):
+        """Emit & record one callback from a test function."""
+        self.emitter.emit(result)
+        self.results.add(self.run_id, result)
+        self.event_log.append(result)
+        if result.get("message type") == "test end":
+            self.event_log.flush()
+            self.save_results(
+                unit_idx=result.get("unit index"),
+                test_name=result.get("test name")
+            )
+
+    def _complete(self):
+        self.emitter.send("test_complete", {"message": "Test execution complete.", "runId": self.run_id})
         self.save_results()
+        self._close_run()
         self.running = False
 
+    def attach_remote(self):
+        """Start a run whose tests execute on a station worker; its events arrive through report()."""
+        self.state = "running"
+        self.running = True
+        self.run_started = time.monotonic()
+        self._open_outputs()
+
+    def remote_progress(self, completed, total):
+        with self._progress_lock:
+            self.steps_done = completed
+            self.total_steps = total
+        self.emitter.send("plan_progress", self.progress())
+
+    def finish_remote(self, state, error=None):
+        """End a station worker's run the same way run() ends a local one."""
+        if self.state != "running":
+            return
+        try:
+            if state == "complete":
+                self._complete()
+            else:
+                if error:
+                    self.emitter.send("run_error", {"runId": self.run_id, "error": error})
+                self._close_run()
+        finally:
+            self.state = state
+            self.running = False
+            self.manager._run_finished(self)
+
+    def _step_done(self, test, unit):
+        with self._progress_lock:
+            self.steps_done += 1
+        self.emitter.send("plan_progress", self.progress())
+        if unit is None or not self.writer.has_unit(unit):
+            self._on_steps_saved(unit, [test])  # nothing of it goes into a result file
+        else:
+            # checkpointed once the writer has saved the step's sheet
+            self.writer.mark(unit, test)
+
+    def _on_steps_saved(self, unit, tests):
+        with self._checkpoint_lock:
+            self.completed.update((unit, t) for t in tests)
+        self._write_checkpoint()
+
+    def _write_checkpoint(self):
+        """Atomically rewrite the run's checkpoint (selection, result files, saved steps, state)."""
+        if self.station is not None:
+            return  # executed by a station worker: nothing here could resume it
+        with self._checkpoint_lock:
+            data = {
+                "runId": self.run_id,
+                "script": self.script_name,
+                "tests": self.selected_tests,
+                "details": self.details,
+                "units": self.selected_units,
+                "runTimestamp": self.run_timestamp,
+                "scriptDigest": self._script_digest,
+                "unitPaths": self._unit_paths,
+                "done": sorted(self.completed, key=lambda d: (d[0] is not None, d[0] or 0, d[1])),
+                "timings": self.timings.rows(),
+                "state": self.state,
+            }
+            path = checkpoint_path(self.run_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, default=str)
+            os.replace(tmp, path)
+
+    def progress(self):
+        """Completed/total plan steps of the current (or last) run, with an ETA from the average step time."""
+        if self.run_started is None:
+            return {"runId": self.run_id, "state": self.state, "running": self.running,
+                    "completedSteps": 0, "totalSteps": 0, "elapsed": 0, "eta": None}
+        total = self.total_steps
+        elapsed = time.monotonic() - self.run_started
+        eta = None
+        if self.steps_done:
+            eta = round(elapsed / self.steps_done * (total - self.steps_done), 1)
+        return {
+            "runId": self.run_id,
+            "state": self.state,
+            "running": self.running,
+            "completedSteps": self.steps_done,
+            "totalSteps": total,
+            "elapsed": round(elapsed, 1),
+            "eta": eta,
+        }
+
+    def _on_results_saved(self, unit_idx, path):
+        self.index.mark_current(path)
+        self.emitter.send("results_saved", {"unit index": unit_idx, "path": path, "runId": self.run_id})
+
+    def _on_results_error(self, unit_idx, error):
+        print(f"Saving results for unit {unit_idx} failed: {error}")
+        self.emitter.send("results_error", {"unit index": unit_idx, "error": str(error), "runId": self.run_id})
+
+    def _close_run(self):
+        """Flush queued updates, add the Timing sheets and close the run's result workbooks and event log."""
+        self.emitter.flush()
+        for u_idx in sorted(self.selected_units):
+            if self.writer.has_unit(u_idx):
+                self.writer.write_sheet(u_idx, SheetData(TIMING_SHEET, RunTimings.COLUMNS, self.timings.rows_for(u_idx)))
+        self.writer.close()
+        if self.event_log is not None:
+            self.event_log.close()
+
+    def _unit_details(self, u_idx):
+        """Map an enabled unit number to its (serial, comment), with defaults."""
+        serials = self.details.get("serials", []) or []
+        comments = self.details.get("comments", []) or []
+        serial = "88888888"
+        comment = "No comment"
+        if u_idx in self.selected_units:
+            di = self.selected_units.index(u_idx)
+            if di < len(serials) and str(serials[di]).strip():
+                serial = str(serials[di]).strip()
+            if di < len(comments) and (comments[di] or "").strip():
+                comment = comments[di]
+        return serial, comment
+
+    def _open_unit_book(self, u_idx):
+        """Open the unit's result workbook in the writer, creating it with a Details sheet."""
+        ts = self.run_timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+        operator = (self.details.get("operatorName") or "").strip() or "Tester"
+        serial, comment = self._unit_details(u_idx)
+        fn = f"{self.script_name}_{serial}_{ts}_{operator}_unit{u_idx}.xlsx"
+        info = {
+            "Script Name": self.script_name,
+            "Device Serial No.": serial,
+            "Operator Name": operator,
+            "Date/Time": datetime.now().isoformat(sep=" "),
+            "Additional Comments": comment,
+            "Unit Index": u_idx,
+        }
+        # a resumed run goes on writing the files it had
+        resumed = self._resume_paths.get(u_idx)
+        out_path = self.manager._claim_path(resumed or os.path.join("results", fn))
+        self._unit_paths[u_idx] = out_path
+        # a reopened file keeps its Details sheet, so its start time in the index stays too
+        reopened = out_path == resumed and os.path.exists(out_path)
+        self.writer.open_unit(u_idx, out_path, info)
+        if not reopened:
+            self.index.record_file(out_path, info)
+
     def save_results(self, unit_idx: int | None = None, test_name: str | None = None) -> None:
         """
-        Persist results to Excel.
-        - If unit_idx and test_name are provided: append/replace only that test's sheet in that unit's file.
-        - Otherwise (legacy): write everything currently in self.test_data.
+        Persist results to the unit's result workbook.
+        - If unit_idx and test_name are provided: add/replace only that test's sheet in that unit's workbook.
+        - Otherwise (legacy): write every test of the current run in self.results.
+        Workbooks stay open in self.writer for the whole run and are flushed to disk
+        by its policy (and always when the run completes or is stopped).
         The workbook filename uses the per-run timestamp (self.run_timestamp).
         """
         os.makedirs("results", exist_ok=True)
 
-        ts = self.run_timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
-        operator = (self.details.get("operatorName") or "").strip() or "Tester"
-        serials = self.details.get("serials", []) or []
-        comments = self.details.get("comments", []) or []
-
-        # Group all collected events by unit index
-        by_unit: dict[int, list[dict]] = defaultdict(list)
-        for entry in self.test_data:
-            u = entry.get("unit index", 0)
-            if u:
-                by_unit[u].append(entry)
-
-        # Decide which units to write
-        unit_items = by_unit.items() if unit_idx is None else [(unit_idx, by_unit.get(unit_idx, []))]
+        # Decide which units to write (once-only tests report without a unit and are not saved)
+        units = self.results.units(self.run_id) if unit_idx is None else [unit_idx]
 
-        for u_idx, entries in unit_items:
-            if not entries:
+        for u_idx in units:
+            if not u_idx:
                 continue
 
-            # Map enabled unit number -> index in details arrays, then pull serial/comment with defaults
-            serial = "88888888"
-            comment = "No comment"
-            if u_idx in self.selected_units:
-                di = self.selected_units.index(u_idx)
-                if di < len(serials) and str(serials[di]).strip():
-                    serial = str(serials[di]).strip()
-                if di < len(comments) and (comments[di] or "").strip():
-                    comment = comments[di]
-
-            # Build file name and ensure a Details sheet exists
-            fn = f"{self.script_name}_{serial}_{ts}_{operator}_unit{u_idx}.xlsx"
-            out_path = os.path.join("results", fn)
-
-            if not os.path.exists(out_path):
-                with pd.ExcelWriter(out_path, engine="openpyxl", mode="w") as w0:
-                    info_row = [{
-                        "Script Name": self.script_name,
-                        "Device Serial No.": serial,
-                        "Operator Name": operator,
-                        "Date/Time": datetime.now().isoformat(sep=" "),
-                        "Additional Comments": comment or "No comment",
-                        "Unit Index": u_idx,
-                    }]
-                    pd.DataFrame(info_row).to_excel(w0, sheet_name="Details", index=False)
-
-            # Group this unit's entries by test name (optionally filter to one test)
-            tests = defaultdict(list)
-            for e in entries:
-                tests[e["test name"]].append(e)
+            # Only this test's record, or every test the unit has reported
             if test_name is not None:
-                tests = {test_name: tests.get(test_name, [])}
-
-            # Append/replace sheets as needed
-            with pd.ExcelWriter(out_path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
-                for tname, evts in tests.items():
-                    if not evts:
-                        continue
-
-                    # Sheet name (Excel-safe)
-                    sheet = tname[:31]
-                    for ch in r'[]:?*\/':
-                        sheet = sheet.replace(ch, "_")
-
-                    rtype = (evts[0].get("result type") or "").lower()
-
-                    if rtype == "boolean":
-                        # final state row: test name, result type, result (pass/fail)
-                        end = next((e for e in evts if e["message type"] == "test end"), evts[-1])
-                        df = pd.DataFrame([{
-                            "test name": tname,
-                            "result type": end.get("result type"),
-                            "result": end.get("pass"),
-                        }])
-                        df.to_excel(writer, sheet_name=sheet, index=False)
-
-                    elif rtype == "number":
-                        # single summary row with unit, expected range, final value, pass
-                        new = next((e for e in evts if e["message type"] == "new test"), evts[0])
-                        end = next((e for e in evts if e["message type"] == "test end"), evts[-1])
-                        df = pd.DataFrame([{
-                            "test name": tname,
-                            "result type": end.get("result type"),
-                            "result unit": new.get("result unit"),
-                            "expected range": new.get("expected range"),
-                            "result value": end.get("result"),
-                            "pass": end.get("pass"),
-                        }], columns=[
-                            "test name", "result type", "result unit",
-                            "expected range", "result value", "pass"
-                        ])
-                        df.to_excel(writer, sheet_name=sheet, index=False)
-
-                    elif rtype == "vector":
-                        # rows: (metadata only on first row) + x,y for each update
-                        new = next((e for e in evts if e["message type"] == "new test"), evts[0])
-                        end = next((e for e in evts if e["message type"] == "test end"), evts[-1])
-
-                        updates = [
-                            u for u in evts
-                            if u.get("message type") == "update"
-                               and isinstance(u.get("result"), (list, tuple))
-                               and len(u.get("result")) >= 2
-                        ]
-
-                        rows = []
-                        for i, u in enumerate(updates):
-                            x_val, y_val = u["result"]
-                            rows.append({
-                                "test name": tname if i == 0 else None,
-                                "result unit": new.get("result unit") if i == 0 else None,
-                                "expected range": new.get("expected range") if i == 0 else None,
-                                "pass": end.get("pass") if i == 0 else None,
-                                "x": x_val,
-                                "y": y_val,
-                            })
-
-                        df = pd.DataFrame(rows, columns=[
-                            "test name", "result unit", "expected range", "pass", "x", "y"
-                        ])
-                        df.to_excel(writer, sheet_name=sheet, index=False)
-
-                    elif rtype == "image":
-                        # header row + embed the image found in the last image event
-                        end_evt = next((e for e in evts if e["message type"] == "test end"), evts[-1])
-                        header_df = pd.DataFrame([{
-                            "test name": tname,
-                            "result type": end_evt.get("result type"),
-                            "pass": end_evt.get("pass"),
-                        }], columns=["test name", "result type", "pass"])
-                        header_df.to_excel(writer, sheet_name=sheet, index=False)
-
-                        # Try to embed the image (expects a /images/... URL)
-                        img_url = next(
-                            (e.get("result") for e in evts if
-                             e.get("message type") in ("update", "test end") and e.get("result")),
-                            None
-                        )
-                        if img_url:
-                            # Map "/images/…/file" → local "images/…/file"
-                            local_path = None
-                            if "/images/" in str(img_url):
-                                local_path = os.path.join("images", str(img_url).split("/images/")[1])
-                            elif str(img_url).startswith("images" + os.sep) or str(img_url).startswith("images/"):
-                                local_path = str(img_url)
-
-                            ws = writer.book[sheet]
-                            if local_path and os.path.exists(local_path):
-                                ws.add_image(XLImage(local_path), "A3")
-                            else:
-                                ws.cell(row=3, column=1, value=f"Image not found: {img_url}")
-
-                    else:
-                        # Fallback: dump raw events for unknown types
-                        pd.DataFrame(evts).to_excel(writer, sheet_name=sheet, index=False)
-
-        # Optional rolling full log (for debugging)
-        pd.DataFrame(self.test_data).to_excel("full_log.xlsx", index=False)
-
-    def parse_results(self, df_map, workbook):
-        """
-        Given a dict of DataFrames from an Excel results file,
-        return (metadata_dict, [result_event_dicts]) suitable for the frontend.
-        """
-        # 1) Metadata from the "Details" sheet
-        details = df_map.get("Details")
-        if details is None:
-            raise ValueError("Missing 'Details' sheet")
-        meta_row = details.iloc[0].to_dict()
-        metadata = {
-            'script name': meta_row.get("Script Name") or meta_row.get("script"),
-            'operatorName': meta_row.get("Operator Name") or meta_row.get("operator"),
-            'timestamp': meta_row.get("Date/Time") or meta_row.get("timestamp"),
-            'unitIndex': meta_row.get("Unit Index") or meta_row.get("unitIndex"),
-            'serial': meta_row.get("Device Serial No.") or meta_row.get("serial"),
-            'comments': meta_row.get("Additional Comments") or meta_row.get("comments"),
-        }
-
-        # 2) Flatten each test-sheet into a sequence of “events”
-        events = []
-        for sheet, df in df_map.items():
-            if sheet == "Details":
+                rec = self.results.get(self.run_id, u_idx, test_name)
+                records = [rec] if rec is not None else []
+            else:
+                records = self.results.tests(self.run_id, u_idx)
+            if not records:
                 continue
 
-            # BOOLEAN: one row, 'result' column holds the pass/fail
-            if 'result type' in df.columns and df['result type'].iloc[0].lower() == 'boolean':
-                for _, r in df.iterrows():
-                    pass_val = r.get("pass", r["result"])
-                    events.append({
-                        'message type': "test end",
-                        'test name': r["test name"],
-                        'unit index': metadata['unitIndex'],
-                        'result type': r['result type'],
-                        'result': r['result'],
-                        'pass': pass_val,
-                        'expected range': None,
-                    })
-
-            # NUMBER: final numeric value + pass/fail
-            elif 'result type' in df.columns and df['result type'].iloc[0].lower() == 'number':
-                # we assume columns: test name, expected range, result value, pass
-                for _, r in df.iterrows():
-                    raw = r.get("expected range")
-                    from ast import literal_eval
-                    try:
-                        rng = literal_eval(raw) if isinstance(raw, str) else raw
-                        expected = list(rng)
-                    except Exception:
-                        expected = []
-                    # ---- new: read the single result-unit as string ----
-                    unit = r.get("result unit", "")
-                    unit_str = str(unit)
-                    events.append({
-                        'message type': "test end",
-                        'test name': r["test name"],
-                        'unit index': metadata['unitIndex'],
-                        'result type': r['result type'],
-                        'result': r.get("result value") or r.get("result"),
-                        'pass': r['pass'],
-                        'result unit': unit_str,
-                        'expected range': expected,
-                    })
-
-            # VECTOR: extract x/y plus metadata columns from the sheet
-            elif "x" in df.columns and "y" in df.columns:
-                exp = df["expected range"].iloc[0] if "expected range" in df.columns else None
-                from ast import literal_eval
-                try:
-                    rng = literal_eval(exp) if isinstance(exp, str) else exp
-                    expected = list(rng)
-                except Exception:
-                    expected = []
-                raw_p = df["pass"].iloc[0] if "pass" in df.columns else None
-                p = str(raw_p)
-                # ---- new: parse header's result unit into two strings ----
-                if "result unit" in df.columns:
-                    raw_u = df["result unit"].iloc[0]
-                    raw_u = re.sub("[!@#$()']", "", raw_u)
-                else:
-                    raw_u = ""
-                # split on comma if present, else duplicate
-                if isinstance(raw_u, str) and "," in raw_u:
-                    parts = [u.strip() for u in raw_u.split(",", 1)]
-                    ru = parts if len(parts) == 2 else [parts[0], parts[0]]
-                else:
-                    u = str(raw_u)
-                    ru = [u, u]
-                # emit one update per x/y row, carrying metadata
-                for _, r in df.iterrows():
-                    events.append({
-                        'message type': "update",
-                        'test name': sheet,
-                        'unit index': metadata['unitIndex'],
-                        'result type': "vector",
-                        'result': [r["x"], r["y"]],
-                        'pass': p.lower(),
-                        'result unit': ru,
-                        'expected range': expected,
-                    })
-                # final “test end” event for this test
-                events.append({
-                    'message type': "test end",
-                    'test name': sheet,
-                    'unit index': metadata['unitIndex'],
-                    'result type': "vector",
-                    'result': None,
-                    'pass': p.lower(),
-                    'result unit': ru,
-                    'expected range': expected,
-                })
-
-            # IMAGE: extract embedded pictures *and* pick up pass/expected range
-            ws = workbook[sheet]
-            if hasattr(ws, "_images") and ws._images:
-                # pull metadata from the DataFrame header
-                img_df = df_map.get(sheet, pd.DataFrame())
-                raw_p = img_df["pass"].iloc[0] if "pass" in img_df.columns else None
-                p = str(raw_p)
-                # create a timestamp-based temp folder with a filesystem-safe name
-                raw_ts = metadata.get("timestamp", "")
-                if isinstance(raw_ts, datetime):
-                    ts = raw_ts.strftime("%Y%m%d_%H%M%S")
+            # Make sure the unit's workbook (and its Details sheet) is open
+            if not self.writer.has_unit(u_idx):
+                self._open_unit_book(u_idx)
+
+            # Add/replace sheets as needed, and keep the results index current
+            for rec in records:
+                start = time.monotonic()
+                self.writer.write_sheet(u_idx, self._build_sheet(rec))
+                self._index_test(u_idx, rec)
+                elapsed = time.monotonic() - start
+                SAVE_SECONDS.observe(elapsed)
+                self.timings.add("save", rec.test_name, u_idx, None, start, elapsed)
+
+    def _index_test(self, u_idx, rec):
+        new = rec.first()
+        end = rec.last()
+        rtype = (rec.result_type or "").lower()
+        self.index.record_test(
+            self._unit_paths[u_idx], rec.test_name, rec.result_type, end.get("pass"),
+            value=None if rtype == "vector" else end.get("result"),
+            result_unit=new.get("result unit"),
+            expected_range=new.get("expected range"),
+            points=len(rec.x) if rtype == "vector" else None,
+        )
+
+    def _build_sheet(self, rec):
+        """Lay out one test's record as a result sheet."""
+        tname = rec.test_name
+        # Sheet name (Excel-safe)
+        sheet = excel_sheet_name(tname)
+
+        rtype = (rec.result_type or "").lower()
+        new = rec.first()
+        end = rec.last()
+
+        if rtype == "boolean":
+            # final state row: test name, result type, result (pass/fail)
+            return SheetData(sheet, ["test name", "result type", "result"], [
+                [tname, end.get("result type"), end.get("pass")],
+            ])
+
+        elif rtype == "number":
+            # single summary row with unit, expected range, final value, pass
+            return SheetData(sheet, [
+                "test name", "result type", "result unit",
+                "expected range", "result value", "pass"
+            ], [
+                [tname, end.get("result type"), new.get("result unit"),
+                 new.get("expected range"), end.get("result"), end.get("pass")],
+            ])
+
+        elif rtype == "vector":
+            # rows: (metadata only on first row) + x,y for each point, straight from the columns
+            xs, ys = rec.x, rec.y
+
+            def rows():
+                points = zip(xs, ys)
+                for x_val, y_val in points:
+                    yield [tname, new.get("result unit"), new.get("expected range"),
+                           end.get("pass"), x_val, y_val]
+                    break
+                for x_val, y_val in points:
+                    yield [None, None, None, None, x_val, y_val]
+            return SheetData(sheet, ["test name", "result unit", "expected range", "pass", "x", "y"], rows())
+
+        elif rtype == "image":
+            # header row + embed the image found in the first image event
+            data = SheetData(sheet, ["test name", "result type", "pass"], [
+                [tname, end.get("result type"), end.get("pass")],
+            ])
+
+            # Try to embed the image (expects a /images/... URL)
+            img_url = next(
+                (e.get("result") for e in itertools.chain(rec.updates, [end]) if e.get("result")),
+                None
+            )
+            if img_url:
+                # Map "/images/…/file" → local "images/…/file"
+                local_path = None
+                if "/images/" in str(img_url):
+                    local_path = os.path.join("images", str(img_url).split("/images/")[1])
+                elif str(img_url).startswith("images" + os.sep) or str(img_url).startswith("images/"):
+                    local_path = str(img_url)
+
+                if local_path and os.path.exists(local_path):
+                    data.image_path = local_path
                 else:
-                    ts = str(raw_ts)
-                    # replace any non-alphanumeric, non-underscore, non-hyphen chars with '_'
-                    ts = re.sub(r'[^A-Za-z0-9_-]', '_', ts)
-                dirpath = os.path.join("images", "past_images_temp", ts)
-                os.makedirs(dirpath, exist_ok=True)
-
-                for idx, img in enumerate(ws._images):
-                    # build a filename: script_test_serial_timestamp_idx.jpg
-                    safe_name = metadata["script name"].replace(" ", "_")
-                    safe_test = sheet.replace(" ", "_")
-                    serial = metadata.get("serial", "")
-                    fname = f"{safe_name}_{safe_test}_{serial}_{ts}_{idx}.jpg"
-                    fullpath = os.path.join(dirpath, fname)
-
-                    # extract PIL image from openpyxl Image object
-                    bio = BytesIO(img._data())
-                    pil = Image.open(bio)
-                    pil.convert("RGB").save(fullpath, format="JPEG")
-
-                    # URL that the frontend can fetch
-                    url = f"http://localhost:5000/images/past_images_temp/{ts}/{fname}"
-
-                    # send it exactly like a 'test end' event
-                    events.append({
-                        "message type": "test end",
-                        "test name": sheet,
-                        "unit index": metadata["unitIndex"],
-                        "result type": "image",
-                        "result": url,
-                        "pass": p.lower(),
-                        "expected range": None
-                    })
-                # done with this sheet
-                continue
-
-        return metadata, events
-
-    def stop_test(self):
+                    data.image_missing = f"Image not found: {img_url}"
+            return data
+
+        else:
+            # Fallback: dump raw events for unknown types
+            evts = rec.events()
+            columns = list(dict.fromkeys(k for e in evts for k in e))
+            return SheetData(sheet, columns, [[e.get(c) for c in columns] for e in evts])
+
+    def export_results(self, unit_idx):
+        """Path of an up-to-date xlsx for a unit of the current (or last) run, generating it if needed."""
+        path = self._unit_paths.get(unit_idx)
+        if path is None:
+            return None
+        return self.writer.export(unit_idx, path)
+
+    def export_event_log(self, out_path=None):
+        """Export the current (or last) run's event log to xlsx; returns the file path or None."""
+        if self.event_log is None:
+            return None
+        self.event_log.flush()
+        out_path = out_path or os.path.join(self.event_log.dir, "full_log.xlsx")
+        return export_xlsx(self.event_log.dir, out_path)
+
+    def stop(self):
+        if self.state == "queued":
+            self.state = "stopped"
+            self.manager._run_finished(self)
         self.running = False
+        if self.on_stop:
+            self.on_stop(self)
 
     def is_running(self):
-        return self.running
\ No newline at end of file
+        return self.running
+
+    def snapshot_payload(self):
+        """The run's current state (see RunSnapshot) as one compressed payload."""
+        return self.snapshot.compressed(runId=self.run_id, script=self.script_name,
+                                        units=sorted(self.selected_units), state=self.state,
+                                        progress=self.progress())
+
+    def summary(self):
+        return {
+            "runId": self.run_id,
+            "script": self.script_name,
+            "units": sorted(self.selected_units),
+            "operatorName": self.details.get("operatorName"),
+            "station": self.station,
+            "state": self.state,
+        }
+
+
+class TestManager:
+    """
+    Registry of runs. Every run gets its own TestRun; runs execute on a bounded
+    pool (MAX_CONCURRENT_RUNS), so several stations can be driven by one server.
+    Scripts, the in-memory result store and the results index are shared.
+    """
+
+    def __init__(self, socketio, max_concurrent_runs=MAX_CONCURRENT_RUNS):
+        self.socketio = socketio
+        self.scripts = ScriptRegistry()
+        self.results = ResultStore()
+        # spill files of runs that died with an earlier server process
+        swept = self.results.sweep()
+        if swept:
+            print(f"Removed {swept} stale spill file(s) from {self.results.spill_dir}")
+        self.index = ResultsIndex()
+        self.runs: dict[str, TestRun] = {}  # run id -> run, oldest first
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrent_runs)
+        self._paths_in_use = set()
+        self._lock = threading.Lock()
+
+    def get_tests(self, script_name):
+        script = self.scripts.load(script_name)
+        if script is None:
+            return {}
+        return script.tree
+
+    def get_max_unit_support(self, script_name):
+        script = self.scripts.load(script_name)
+        if script is None:
+            return {}
+        return script.max_units
+
+    def create_run(self, script_name, selected_tests, details, selected_units) -> TestRun:
+        """Register a new (queued) run; start() or run_tests() executes it."""
+        run = TestRun(self, script_name, selected_tests, details, selected_units)
+        with self._lock:
+            self.runs[run.run_id] = run
+        return run
+
+    def start(self, run):
+        """Queue a created run on the run pool."""
+        self._pool.submit(run.run)
+        return run
+
+    def run_tests(self, script_name, selected_tests, details, selected_units) -> TestRun:
+        """Create a run and execute it on the calling thread."""
+        run = self.create_run(script_name, selected_tests, details, selected_units)
+        run.run()
+        return run
+
+    def resume(self, run_id):
+        """
+        A queued run continuing a stopped, failed or interrupted run from its checkpoint
+        (same id and result files; steps already saved are skipped), or None if the
+        run has no checkpoint. start() or run() executes it. ValueError if it can't resume.
+        """
+        checkpoint = read_checkpoint(run_id)
+        if checkpoint is None:
+            return None
+        if checkpoint.get("state") == "complete":
+            raise ValueError(f"Run '{run_id}' already completed")
+        with self._lock:
+            old = self.runs.get(run_id)
+            if old is not None and old.station is not None:
+                raise ValueError(f"Run '{run_id}' was executed by station worker '{old.station}'")
+            if old is not None and old.state in ("queued", "running"):
+                raise ValueError(f"Run '{run_id}' is still running")
+            run = TestRun(self, checkpoint["script"], checkpoint["tests"], checkpoint["details"],
+                          checkpoint["units"], checkpoint=checkpoint)
+            self.runs.pop(run_id, None)
+            self.runs[run_id] = run
+        self.results.drop_run(run_id)
+        return run
+
+    def resumable_runs(self):
+        """Checkpointed runs that did not complete and aren't running now (station workers' runs never are)."""
+        with self._lock:
+            remote = {run_id for run_id, run in self.runs.items() if run.station is not None}
+        runs = []
+        for path in sorted(glob.glob(os.path.join(LOG_DIR, "*", CHECKPOINT_FILE))):
+            checkpoint = read_checkpoint(os.path.basename(os.path.dirname(path)))
+            if checkpoint is None or checkpoint.get("state") == "complete" \
+                    or checkpoint["runId"] in remote or self.is_running(checkpoint["runId"]):
+                continue
+            runs.append({
+                "runId": checkpoint["runId"],
+                "script": checkpoint["script"],
+                "units": sorted(checkpoint["units"]),
+                "operatorName": checkpoint["details"].get("operatorName"),
+                "state": checkpoint["state"],
+                "completedSteps": len(checkpoint["done"]),
+            })
+        return runs
+
+    def get_run(self, run_id=None):
+        """A run by id; without one, the most recently created run."""
+        with self._lock:
+            if run_id is None:
+                return next(reversed(self.runs.values()), None)
+            return self.runs.get(run_id)
+
+    def list_runs(self):
+        with self._lock:
+            return [run.summary() for run in self.runs.values()]
+
+    def active_runs(self):
+        """Runs that are queued or running, oldest first."""
+        with self._lock:
+            return [r for r in self.runs.values() if r.state in ("queued", "running")]
+
+    def progress(self, run_id=None):
+        run = self.get_run(run_id)
+        if run is None:
+            return {"running": False, "completedSteps": 0, "totalSteps": 0, "elapsed": 0, "eta": None}
+        return run.progress()
+
+    def preview_plan(self, script_name, selected_tests, selected_units):
+        """Compile the plan a run would execute, without running it."""
+        script = self.scripts.load(script_name)
+        if script is None:
+            return None
+        mod = script.module
+        raw = script.raw
+        unit_numbers = sorted(selected_units)
+        parallel = bool(getattr(mod, "PARALLEL_UNITS", False)) and len(unit_numbers) > 1
+        return compile_plan(raw, selected_tests, unit_numbers, parallel)
+
+    def parse_results(self, raw):
+        """
+        Given the bytes of an Excel results file,
+        return (metadata_dict, [result_event_dicts]) suitable for the frontend.
+        """
+        return read_results(raw)
+
+    def export_results(self, unit_idx, run_id=None):
+        run = self.get_run(run_id)
+        return run.export_results(unit_idx) if run else None
+
+    def export_event_log(self, out_path=None, run_id=None):
+        run = self.get_run(run_id)
+        return run.export_event_log(out_path) if run else None
+
+    def stop_test(self, run_id=None):
+        """Stop one run, or every unfinished run; returns the ids that were stopped."""
+        if run_id is None:
+            runs = self.active_runs()
+        else:
+            with self._lock:
+                runs = [self.runs[run_id]] if run_id in self.runs else []
+        for run in runs:
+            run.stop()
+        return [run.run_id for run in runs]
+
+    def is_running(self, run_id=None):
+        with self._lock:
+            runs = list(self.runs.values()) if run_id is None else [self.runs.get(run_id)]
+        return any(r is not None and r.state in ("queued", "running") for r in runs)
+
+    def _claim_path(self, path):
+        """Reserve a result file path for a run, suffixing it if another active run already writes there."""
+        with self._lock:
+            base, ext = os.path.splitext(path)
+            n = 1
+            while path in self._paths_in_use:
+                n += 1
+                path = f"{base}_{n}{ext}"
+            self._paths_in_use.add(path)
+        return path
+
+    def _run_finished(self, run):
+        """Release the run's file paths and forget the oldest finished runs beyond KEEP_FINISHED_RUNS."""
+        with self._lock:
+            self._paths_in_use.difference_update(run._unit_paths.values())
+            finished = [r for r in self.runs.values() if r.state not in ("queued", "running")]
+            for old in finished[:max(0, len(finished) - KEEP_FINISHED_RUNS)]:
+                del self.runs[old.run_id]
+                self.results.drop_run(old.run_id)
\ No newline at end of file
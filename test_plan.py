@@ -0,0 +1,189 @@
+from collections import defaultdict
+
+
+def strip_tree(tree):
+    """Strip functions and execution-order metadata, leaving only the test hierarchy."""
+    cleaned = {}
+    for k, v in tree.items():
+        # drop our execution‐order metadata (and the funcs list)
+        if k in ('funcs', 'exec_order'):
+            continue
+        # only recurse into real dicts
+        if isinstance(v, dict):
+            cleaned[k] = strip_tree(v)
+        else:
+            # leaf‐node guard: we expect subtests to be dicts
+            cleaned[k] = {}
+    return cleaned
+
+
+def flatten_tests(raw):
+    """
+    Flatten an AVAILABLE_TESTS tree into tree-ordered full test names,
+    plus the funcs and exec_order of each one.
+    """
+    ordered = []
+    funcs_map = {}
+    exec_order_map = {}
+
+    def extract(tree, parent=""):
+        for name, subtree in tree.items():
+            if name in ("funcs", "exec_order"):
+                continue
+            full = f"{parent}/{name}" if parent else name
+            ordered.append(full)
+            funcs_map[full] = subtree.get("funcs", [])
+            exec_order_map[full] = subtree.get("exec_order", 0)
+            extract(subtree, full)
+
+    extract(raw)
+    return ordered, funcs_map, exec_order_map
+
+
+class Phase:
+    """
+    One step of a plan: either a once-only test (kind "once", unit None),
+    or a block of per-unit tests of one exec_order (kind "units") given as
+    lanes {unit: [tests in tree order]}.
+    """
+
+    def __init__(self, kind, exec_order, test=None):
+        self.kind = kind
+        self.exec_order = exec_order
+        self.test = test
+        self.lanes: dict[int, list[str]] = {}
+
+    def steps(self):
+        """(test, unit) pairs in sequential execution order."""
+        if self.kind == "once":
+            return [(self.test, None)]
+        return [(t, u) for u, tests in self.lanes.items() for t in tests]
+
+    def to_dict(self):
+        if self.kind == "once":
+            return {"kind": "once", "execOrder": self.exec_order, "test": self.test}
+        return {
+            "kind": "units",
+            "execOrder": self.exec_order,
+            "lanes": [{"unit": u, "tests": tests} for u, tests in self.lanes.items()],
+        }
+
+
+class TestPlan:
+    """The explicit, ordered list of phases a run will execute."""
+
+    def __init__(self, tests, funcs_map, exec_order_map, unit_numbers, parallel):
+        self.tests = tests
+        self.funcs_map = funcs_map
+        self.exec_order_map = exec_order_map
+        self.unit_numbers = unit_numbers
+        self.parallel = parallel
+        self.phases: list[Phase] = []
+        # selected tests that can never run (exec_order 0, or blocked behind one)
+        self.skipped: list[str] = []
+
+    def steps(self):
+        return [s for p in self.phases for s in p.steps()]
+
+    @property
+    def total_steps(self):
+        return sum(1 if p.kind == "once" else sum(len(t) for t in p.lanes.values()) for p in self.phases)
+
+    def to_dict(self):
+        return {
+            "parallel": self.parallel,
+            "units": self.unit_numbers,
+            "totalSteps": self.total_steps,
+            "phases": [p.to_dict() for p in self.phases],
+            "skipped": self.skipped,
+        }
+
+
+def compile_plan(raw, selected_tests, unit_numbers, parallel=False):
+    """
+    Turn an AVAILABLE_TESTS tree and the user's selection into a TestPlan.
+
+    Sequential plans reproduce the classic scheduler order: for each exec_order,
+    for each unit, walk the tree running that unit's tests of this exec_order;
+    a once-only (exec_order == -1) test runs as soon as every test before it in
+    the tree is done on every unit.
+    Parallel plans run each exec_order's per-unit tests on all units together,
+    with once-only tests as barriers between those blocks.
+    """
+    ordered_full, funcs_full, order_full = flatten_tests(raw)
+    selected = set(selected_tests)
+    tests = [t for t in ordered_full if t in selected]
+    funcs_map = {t: funcs_full[t] for t in tests}
+    exec_order_map = {t: order_full[t] for t in tests}
+    unit_numbers = sorted(unit_numbers)
+    plan = TestPlan(tests, funcs_map, exec_order_map, unit_numbers, parallel)
+
+    # Precomputed dependency state: a once-only test at index i is ready when
+    # the first i tests are all done, i.e. when done_upto >= i.
+    remaining = [1 if exec_order_map[t] == -1 else len(unit_numbers) for t in tests]
+    state = {"done_upto": 0}
+
+    def mark(i):
+        remaining[i] -= 1
+        while state["done_upto"] < len(tests) and remaining[state["done_upto"]] <= 0:
+            state["done_upto"] += 1
+
+    # Only once-only tests and the tests of the current exec_order are ever looked at
+    once_idx = [i for i, t in enumerate(tests) if exec_order_map[t] == -1]
+    by_order = defaultdict(list)
+    for i, t in enumerate(tests):
+        if exec_order_map[t] > 0:
+            by_order[exec_order_map[t]].append(i)
+
+    def candidates(order):
+        return sorted(once_idx + by_order.get(order, []))
+
+    def run_once(i):
+        plan.phases.append(Phase("once", -1, tests[i]))
+        mark(i)
+
+    def add_unit_step(order, unit, i):
+        last = plan.phases[-1] if plan.phases else None
+        if last is None or last.kind != "units" or last.exec_order != order:
+            last = Phase("units", order)
+            plan.phases.append(last)
+        last.lanes.setdefault(unit, []).append(tests[i])
+
+    def add_block(order, segment):
+        for u in unit_numbers:
+            for j in segment:
+                add_unit_step(order, u, j)
+        for j in segment:
+            for _ in unit_numbers:
+                mark(j)
+
+    for order in sorted(by_order):
+        if parallel:
+            segment = []
+            for i in candidates(order):
+                if exec_order_map[tests[i]] != -1:
+                    segment.append(i)
+                elif remaining[i] > 0:
+                    # barrier: close the current block before a once-only test
+                    add_block(order, segment)
+                    segment = []
+                    if state["done_upto"] >= i:
+                        run_once(i)
+            add_block(order, segment)
+        else:
+            for u in unit_numbers:
+                for i in candidates(order):
+                    if exec_order_map[tests[i]] == -1:
+                        if remaining[i] > 0 and state["done_upto"] >= i:
+                            run_once(i)
+                    else:
+                        add_unit_step(order, u, i)
+                        mark(i)
+
+    # Once-only tests that only depend on other once-only tests (or nothing)
+    for i in once_idx:
+        if remaining[i] > 0 and state["done_upto"] >= i:
+            run_once(i)
+
+    plan.skipped = [t for i, t in enumerate(tests) if remaining[i] > 0]
+    return plan
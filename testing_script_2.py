@@ -190,6 +190,9 @@ def test_image(callback, full_test_name, selected_units, unit_index):
 
 # how many units this script supports
 MULTI_UNIT_SUPPORTED_NUMBER = 4
+# run per-unit tests of the same exec_order on all units at once (and at most this many at a time)
+PARALLEL_UNITS = False
+MAX_PARALLEL_UNITS = 4
 # Full AVAILABLE_TESTS declaration
 AVAILABLE_TESTS = {
     'Temp_25': {'funcs': [change_temperature_to_25], 'exec_order': -1,
@@ -0,0 +1,104 @@
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image, UnidentifiedImageError
+from image_store import get_originals
+from offload import offload
+
+THUMBNAIL_DIR = os.path.join("images", "thumbs")
+# Largest (width, height) embedded in a result workbook; larger images are scaled down to fit
+THUMBNAIL_MAX_SIZE = (800, 600)
+# JPEG quality of the embedded thumbnails (images with transparency are embedded as PNG)
+THUMBNAIL_QUALITY = 80
+# Source files remembered by (path, mtime, size), so an image reported for every unit is read once
+THUMBNAIL_MEMO_SIZE = 256
+
+
+class Thumbnailer:
+    """
+    Turns a result image into what goes into a workbook: the full-resolution
+    original is kept once in the originals image store (and linked from the
+    sheet), and a bounded-size thumbnail of it is what gets embedded.
+    Thumbnails are files in images/thumbs named after the original's hash and the
+    size/quality settings, so the same image is only decoded and resized once.
+    Only the decoding and resizing is offloaded to a real thread; the locks here
+    and in the image store are taken on the caller's side.
+    """
+
+    def __init__(self, root=THUMBNAIL_DIR, max_size=THUMBNAIL_MAX_SIZE, quality=THUMBNAIL_QUALITY,
+                 memo_size=THUMBNAIL_MEMO_SIZE):
+        self.root = root
+        self.max_size = tuple(max_size)
+        self.quality = quality
+        self.memo_size = memo_size
+        self._memo: OrderedDict[tuple, tuple] = OrderedDict()  # (path, mtime_ns, size) -> result
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def embed(self, path):
+        """(path of the image to embed, image store name of the original) for a local image file."""
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            hit = self._memo.get(key)
+            if hit is not None and os.path.exists(hit[0]):
+                self._memo.move_to_end(key)
+                return hit
+
+        with open(path, "rb") as f:
+            data = f.read()
+        original = get_originals().put(data)
+        result = (offload(self._thumbnail, data, original) or path, original)
+
+        with self._lock:
+            self._memo[key] = result
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return result
+
+    def _thumbnail(self, data, original):
+        """Path of the original's thumbnail (made if needed), or None to embed the original as it is."""
+        stem = os.path.splitext(original)[0]
+        w, h = self.max_size
+        for ext in ("jpg", "png"):
+            path = os.path.join(self.root, f"{stem}_{w}x{h}_q{self.quality}.{ext}")
+            if os.path.exists(path):
+                return path
+        try:
+            with Image.open(BytesIO(data)) as im:
+                if im.width <= w and im.height <= h:
+                    return None  # already small enough
+                im.draft("RGB", self.max_size)  # JPEGs decode straight at a reduced scale
+                im.thumbnail(self.max_size)
+                transparent = im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info)
+                out = BytesIO()
+                if transparent:
+                    ext = "png"
+                    im.save(out, "PNG", optimize=True)
+                else:
+                    ext = "jpg"
+                    im.convert("RGB").save(out, "JPEG", quality=self.quality, optimize=True)
+        except (UnidentifiedImageError, OSError) as e:
+            print(f"Could not make a thumbnail of {original}: {e}")
+            return None
+        path = os.path.join(self.root, f"{stem}_{w}x{h}_q{self.quality}.{ext}")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(out.getvalue())
+        os.replace(tmp, path)
+        return path
+
+
+_thumbnailer = None
+_thumbnailer_lock = threading.Lock()
+
+
+def get_thumbnailer() -> Thumbnailer:
+    """The process-wide thumbnailer."""
+    global _thumbnailer
+    with _thumbnailer_lock:
+        if _thumbnailer is None:
+            _thumbnailer = Thumbnailer()
+        return _thumbnailer